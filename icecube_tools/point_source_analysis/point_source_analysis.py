@@ -5,24 +5,135 @@ from ..point_source_likelihood.point_source_likelihood import (
 )
 
 from ..simulator import BackgroundSimulator
-from ..utils.data import ddict, Events, Uptime, RealEvents, Uptime
+from ..utils.data import Events, Uptime, RealEvents, Uptime, data_directory
 from ..utils.coordinate_transforms import *
 
 import yaml
+try:
+    from yaml import CSafeLoader as SafeLoader, CSafeDumper as SafeDumper
+except ImportError:
+    from yaml import SafeLoader, SafeDumper
 import h5py
-import healpy as hp
 import numpy as np
 from tqdm import tqdm as progress_bar
 
 from abc import ABC, abstractmethod
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
 
+import os
 import os.path
+import copy
+import queue
 import logging
 from typing import Tuple, Dict
 
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.WARNING)
 
+class _ConfigLoader(SafeLoader):
+    """
+    Safe yaml loader, additionally reads configs written by earlier versions,
+    in which the config is tagged as `ddict`.
+    """
+
+    def construct_ddict(self, node):
+        return self.construct_mapping(node, deep=True)["dictitems"]
+
+
+_ConfigLoader.add_constructor(
+    "tag:yaml.org,2002:python/object/new:icecube_tools.utils.data.ddict",
+    _ConfigLoader.construct_ddict,
+)
+
+
+class _ConfigDumper(SafeDumper):
+    """
+    Safe yaml dumper, additionally writes numpy scalars and arrays as plain python types.
+    """
+
+
+_ConfigDumper.add_multi_representer(
+    np.generic, lambda dumper, value: dumper.represent_data(value.item())
+)
+_ConfigDumper.add_representer(
+    np.ndarray, lambda dumper, value: dumper.represent_data(value.tolist())
+)
+
+# Declination separating the northern, equatorial and southern regions of the energy cuts
+_DEC_HORIZON = np.deg2rad(10.0)
+
+# Number of test sources handed to a worker process at once
+_CHUNK_SIZE = 60
+
+# Output arrays of `MapScan`, one entry per test source
+_OUTPUT_ARRAYS = (
+    "ts",
+    "index",
+    "ns",
+    "ns_error",
+    "index_error",
+    "fit_ok",
+    "index_merror",
+    "ns_merror",
+)
+
+# State of a worker process of a parallel scan, set by `_init_worker`
+_worker_state = None
+
+
+def _strip_none(config: Dict) -> Dict:
+    """
+    Remove entries which are None or empty dicts from a nested config dict.
+    """
+
+    stripped = {}
+    for key, value in config.items():
+        if isinstance(value, dict):
+            value = _strip_none(value)
+        if value is None or value == {}:
+            continue
+        stripped[key] = value
+    return stripped
+
+
+def _split_sources(num: int, n_jobs: int):
+    """
+    Split the indices of test sources into chunks, at least one for each worker
+    and of at most `_CHUNK_SIZE` sources, s.t. the output file is refreshed regularly.
+    :param num: Number of test sources
+    :param n_jobs: Number of workers
+    :return: List of arrays of indices
+    """
+
+    num_chunks = max(1, min(num, n_jobs), -(-num // _CHUNK_SIZE))
+    return np.array_split(np.arange(num), num_chunks)
+
+
+def _init_worker(scan, ra: Dict, dec: Dict, reco_energy: Dict, ang_err: Dict):
+    """
+    Store the scan and events in the worker process,
+    s.t. they are only transferred once per process and not once per source.
+    """
+
+    global _worker_state
+    _worker_state = (scan, ra, dec, reco_energy, ang_err)
+
+
+def _test_sources(indices: np.ndarray, minos: bool):
+    """
+    Test sources of the worker's scan.
+    :param indices: Indices of test sources in `scan.ra_test, scan.dec_test`
+    :param minos: True if `Minuit.minos()` should be called for calculating errors
+    :return: Tuple of indices and dict of the corresponding output
+    """
+
+    scan, ra, dec, reco_energy, ang_err = _worker_state
+    for c in indices:
+        scan._test_source(
+            (scan.ra_test[c], scan.dec_test[c]), c, ra, dec, reco_energy, ang_err, minos
+        )
+    return indices, {name: getattr(scan, name)[indices] for name in _OUTPUT_ARRAYS}
+
 
 """
 Classes to perform reproducible point source analyses
@@ -115,19 +226,39 @@ class MapScan(PointSourceAnalysis):
 
         self.output_path = output_path
 
-    def perform_scan(self, show_progress: bool = False, minos: bool = False):
+    def perform_scan(
+        self,
+        show_progress: bool = False,
+        minos: bool = False,
+        n_jobs: int = 1,
+        backend: str = "process",
+    ):
         """
         Perform scan over provided source list whose coordinates are stored in `self.ra_test, self.dec_test`
         :param show_progress: True if progress bar should be displayd
         :param minos: True if additionally `Minuit.minos()` should be called for calculating errors
+        :param n_jobs: Number of workers, a positive integer or -1 to use all available CPUs,
+            1 (default) runs the scan in the calling process
+        :param backend: "process" (default) or "thread", kind of workers used if `n_jobs != 1`,
+            threads avoid copying the events to each worker but are limited by the GIL
         """
+        if not isinstance(n_jobs, (int, np.integer)) or n_jobs == 0 or n_jobs < -1:
+            raise ValueError(
+                f"n_jobs has to be a positive integer or -1 for all CPUs, got {n_jobs}"
+            )
+        if backend not in ("process", "thread"):
+            raise ValueError(f"Unknown backend {backend}, use 'process' or 'thread'")
         # s = sched.scheduler(time.time, time.sleep)
         logger.info("Performing scan for periods: {}".format(self.events.periods))
-        ra = self.events.ra
-        dec = self.events.dec
-        ang_err = self.events.ang_err
-        reco_energy = self.events.reco_energy
-        if show_progress:
+        ra = self._contiguous(self.events.ra)
+        dec = self._contiguous(self.events.dec)
+        ang_err = self._contiguous(self.events.ang_err)
+        reco_energy = self._contiguous(self.events.reco_energy)
+        if n_jobs != 1:
+            self._perform_scan_parallel(
+                ra, dec, reco_energy, ang_err, minos, n_jobs, show_progress, backend
+            )
+        elif show_progress:
             for c in progress_bar(range(len(self.ra_test))):
                 self._test_source(
                     (self.ra_test[c], self.dec_test[c]),
@@ -151,6 +282,103 @@ class MapScan(PointSourceAnalysis):
                     self.write_output(self.output_path, source_list=True)
         self.write_output(self.output_path, source_list=True)
 
+    @staticmethod
+    def _contiguous(data: Dict) -> Dict:
+        """
+        Copy event data of each period into a contiguous single precision array.
+        Halves the memory held and read by the likelihoods of all periods,
+        the precision is sufficient for the fits.
+        :param data: Dict with period as key, providing some event property
+        :return: Dict of the same structure with float32 arrays
+        """
+
+        return {p: np.ascontiguousarray(v, dtype=np.float32) for p, v in data.items()}
+
+    def _perform_scan_parallel(
+        self,
+        ra: Dict,
+        dec: Dict,
+        reco_energy: Dict,
+        ang_err: Dict,
+        minos: bool,
+        n_jobs: int,
+        show_progress: bool = False,
+        backend: str = "process",
+    ):
+        """
+        Distribute the test sources in chunks over multiple workers.
+        Each worker builds its own likelihood once and tests all sources of the chunks it receives,
+        results are collected in the output arrays of `self`.
+        Threads receive the event arrays and write to the output arrays without copying or pickling them.
+        Each thread still builds its own likelihood, including its energy likelihoods with their IRFs,
+        and the likelihood evaluated by the minimiser is python code holding the GIL.
+        Only numpy sections of the fits run concurrently, processes are the default for CPU-bound scans.
+        :param ra: Dict with period as key, providing event RAs in radians
+        :param dec: Dict with period as key, providing event DECs in radians
+        :param reco_energy: Dict with period as key, providing reconstructed energy in GeV
+        :param ang_err: Dict with period as key, providing 68% angular errors in degrees
+        :param minos: True if `Minuit.minos()` should be called for calculating errors
+        :param n_jobs: Number of workers, positive or -1 for all available CPUs
+        :param show_progress: True if progress bar should be displayed
+        :param backend: "process" or "thread"
+        """
+
+        if n_jobs == -1:
+            n_jobs = os.cpu_count()
+        chunks = _split_sources(len(self.ra_test), n_jobs)
+
+        # Likelihood of the main process is not needed by the workers
+        scan = copy.copy(self)
+        scan.__dict__.pop("likelihood", None)
+
+        if backend == "thread":
+            # Shallow copies share the output arrays of `self`,
+            # each thread fits with the likelihood of the copy it holds
+            scans = queue.SimpleQueue()
+            for _ in range(n_jobs):
+                scans.put(copy.copy(scan))
+
+            def test_sources(indices):
+                worker_scan = scans.get()
+                try:
+                    for c in indices:
+                        worker_scan._test_source(
+                            (self.ra_test[c], self.dec_test[c]),
+                            c,
+                            ra,
+                            dec,
+                            reco_energy,
+                            ang_err,
+                            minos,
+                        )
+                finally:
+                    scans.put(worker_scan)
+                # Results are already written to the output arrays
+                return indices, {}
+
+            executor = ThreadPoolExecutor(max_workers=n_jobs)
+            submit = lambda chunk: executor.submit(test_sources, chunk)
+        else:
+            executor = ProcessPoolExecutor(
+                max_workers=n_jobs,
+                initializer=_init_worker,
+                initargs=(scan, ra, dec, reco_energy, ang_err),
+            )
+            submit = lambda chunk: executor.submit(_test_sources, chunk, minos)
+
+        with executor:
+            futures = [submit(chunk) for chunk in chunks]
+            if show_progress:
+                done = progress_bar(as_completed(futures), total=len(futures))
+            else:
+                done = as_completed(futures)
+            for future in done:
+                indices, output = future.result()
+                for name, values in output.items():
+                    getattr(self, name)[indices] = values
+                # refresh output file
+                self.write_output(self.output_path, source_list=True)
+
     def _test_source(
         self,
         source_coord: Tuple[float, float],
@@ -217,9 +445,10 @@ class MapScan(PointSourceAnalysis):
         """
 
         with open(path, "r") as f:
-            config = yaml.load(f, Loader=yaml.Loader)
+            config = yaml.load(f, Loader=_ConfigLoader)
         logger.debug("{}".format(str(config)))  # ?!
         self.config = config
+        self.pix_test = None
         source_config = config.get("sources", False)
         if source_config:
             self.nside = source_config.get("nside")
@@ -270,48 +499,32 @@ class MapScan(PointSourceAnalysis):
         :param source_list: True if source list (ra, dec) should be written to config
         """
 
-        config = ddict()
-        try:
-            config.add(self.nside, "sources", "nside")
-        except AttributeError:
-            pass
-        try:
-            config.add(self.npix, "sources", "npix")
-        except AttributeError:
-            pass
-        if source_list:
-            config.add(self.ra_test.tolist(), "sources", "ra")
-            config.add(self.dec_test.tolist(), "sources", "dec")
-        config.add(self._data_periods, "data", "periods")
-        try:
-            for emin, region in zip(
-                [self.northern_emin, self.equator_emin, self.southern_emin],
-                ["northern", "equator", "southern"],
-            ):
-                config.add(emin, "data", "cuts", region, "emin")
-        except AttributeError:
-            pass
-        try:
-            config.add(self.min_dec, "data", "cuts", "min_dec")
-        except AttributeError:
-            config.add(-90, "data", "cuts", "min_dec")
-        try:
-            config.add(self.max_dec, "data", "cuts", "max_dec")
-        except AttributeError:
-            config.add(90, "data", "cuts", "min_dec")
-        config.add(self.which, "data", "likelihood")
-
-        try:
-            config.add(self.ntrials, "ts", "ntrials")
-        except AttributeError:
-            pass
-        try:
-            config.add(self.seed, "ts", "seed")
-        except AttributeError:
-            pass
+        config = {
+            "sources": {
+                "nside": getattr(self, "nside", None),
+                "npix": getattr(self, "npix", None),
+                "ra": self.ra_test.tolist() if source_list else None,
+                "dec": self.dec_test.tolist() if source_list else None,
+            },
+            "data": {
+                "periods": self._data_periods,
+                "cuts": {
+                    "northern": {"emin": getattr(self, "northern_emin", None)},
+                    "equator": {"emin": getattr(self, "equator_emin", None)},
+                    "southern": {"emin": getattr(self, "southern_emin", None)},
+                    "min_dec": getattr(self, "min_dec", -90),
+                    "max_dec": getattr(self, "max_dec", 90),
+                },
+                "likelihood": self.which,
+            },
+            "ts": {
+                "ntrials": getattr(self, "ntrials", None),
+                "seed": getattr(self, "seed", None),
+            },
+        }
 
         with open(path, "w") as f:
-            yaml.dump(config, f)
+            yaml.dump(_strip_none(config), f, Dumper=_ConfigDumper)
 
     def write_output(self, path: str, source_list: bool = False):
         """
@@ -333,6 +546,8 @@ class MapScan(PointSourceAnalysis):
             meta = f.create_group("meta")
             meta.create_dataset("ra", shape=self.ra_test.shape, data=self.ra_test)
             meta.create_dataset("dec", shape=self.dec_test.shape, data=self.dec_test)
+            if self.pix_test is not None:
+                meta.create_dataset("pix", shape=self.pix_test.shape, data=self.pix_test)
             meta.create_dataset("periods", data=self._data_periods)
             meta.attrs["config_path"] = os.path.splitext(path)[0] + ".yaml"
 
@@ -377,6 +592,8 @@ class MapScan(PointSourceAnalysis):
                 obj.fit_ok = f["output/fit_ok"][()]
                 obj.ra_test = f["meta/ra"][()]
                 obj.dec_test = f["meta/dec"][()]
+                if "pix" in f["meta"]:
+                    obj.pix_test = f["meta/pix"][()]
                 return obj
 
             else:
@@ -391,19 +608,32 @@ class MapScan(PointSourceAnalysis):
                 output["fit_ok"] = f["output/fit_ok"][()]
                 output["ra_test"] = f["meta/ra"][()]
                 output["dec_test"] = f["meta/dec"][()]
+                if "pix" in f["meta"]:
+                    output["pix_test"] = f["meta/pix"][()]
                 output["config_path"] = f["meta"].attrs["config_path"]
                 return output
 
-    def generate_sources(self, nside: bool = True):
+    def generate_sources(self, nside: bool = True, radius: float = None):
         """
         Generate sources from config-specified specifics.
         Provided ra, dec lists take priority over npix and nside.
+        Healpy pixel indices of the test sources are stored in `self.pix_test`.
         :param nside: If healpy's nside should be used in calculating test sources.
+        :param radius: If provided, only keep pixels whose centre is within `radius` [deg] of any event,
+            e.g. a few times the largest angular error. Pixels without events nearby have TS = 0.
+            Only applies to sources generated from healpy pixels.
         """
 
+        import healpy as hp
+
         reload = True
         if self.ra_test is not None and self.dec_test is not None:
             assert len(self.ra_test) == len(self.dec_test)
+            if radius is not None:
+                raise ValueError(
+                    "radius can only be used for sources generated from healpy pixels, "
+                    "not with the provided ra and dec"
+                )
             logger.info("Using provided ra and dec")
             reload = False
         elif self.nside and nside:
@@ -416,24 +646,107 @@ class MapScan(PointSourceAnalysis):
             logger.info(
                 f"resolution in degrees: {hp.nside2resol(self.nside, arcmin=True)/60}"
             )
-            theta_test, phi_test = hp.pix2ang(
-                self.nside, np.arange(self.npix), nest=False
+            ra_test, dec_test = self._healpix_coordinates()
+            ra_test = ra_test[: self.npix]
+            dec_test = dec_test[: self.npix]
+            keep = (dec_test <= np.deg2rad(self.max_dec)) & (
+                dec_test >= np.deg2rad(self.min_dec)
             )
-            ra_test, dec_test = spherical_to_icrs(theta_test, phi_test)
-            self.ra_test = ra_test[
-                np.nonzero(
-                    (dec_test <= np.deg2rad(self.max_dec))
-                    & (dec_test >= np.deg2rad(self.min_dec))
-                )
-            ]
-            self.dec_test = dec_test[
-                np.nonzero(
-                    (dec_test <= np.deg2rad(self.max_dec))
-                    & (dec_test >= np.deg2rad(self.min_dec))
-                )
-            ]
+            if radius is not None:
+                keep &= self._pixels_near_events(radius)[: self.npix]
+            selected = np.nonzero(keep)
+            self.pix_test = selected[0]
+            self.ra_test = ra_test[selected]
+            self.dec_test = dec_test[selected]
         self._make_output_arrays()
 
+    def _pixels_near_events(self, radius: float):
+        """
+        Find all pixels of a healpy map with `self.nside` whose centre is within `radius` of any event.
+        Discs enlarged by the maximum pixel radius are queried around the pixels containing events,
+        not around each event. Pixels inside these discs are only candidates,
+        they are kept if any event of the pixel at the disc's centre is within `radius`.
+        :param radius: Radius of the discs around events [deg]
+        :return: Boolean mask over all pixels, in ring ordering
+        """
+
+        import healpy as hp
+
+        ra = np.concatenate([self.events.ra[p] for p in self.events.periods])
+        dec = np.concatenate([self.events.dec[p] for p in self.events.periods])
+        event_pix = hp.ang2pix(self.nside, *icrs_to_spherical(ra, dec))
+
+        # Group events by the pixel containing them
+        order = np.argsort(event_pix, kind="stable")
+        ra = ra[order]
+        dec = dec[order]
+        event_pix, start, counts = np.unique(
+            event_pix[order], return_index=True, return_counts=True
+        )
+
+        ra_pix, dec_pix = self._healpix_coordinates()
+        radius = np.deg2rad(radius)
+        # Events are within `max_pixrad` of the centre of their pixel
+        disc_radius = radius + hp.max_pixrad(self.nside)
+        mask = np.zeros(hp.nside2npix(self.nside), dtype=bool)
+        for pix, s, n in zip(event_pix, start, counts):
+            candidates = hp.query_disc(self.nside, hp.pix2vec(self.nside, pix), disc_radius)
+            candidates = candidates[~mask[candidates]]
+            if candidates.size == 0:
+                continue
+            dist = angular_separation(
+                ra_pix[candidates, np.newaxis],
+                dec_pix[candidates, np.newaxis],
+                ra[np.newaxis, s : s + n],
+                dec[np.newaxis, s : s + n],
+            )
+            mask[candidates[np.any(dist <= radius, axis=1)]] = True
+        return mask
+
+    def healpix_map(self, values: np.ndarray, fill_value: float = 0.0) -> np.ndarray:
+        """
+        Scatter an output array, e.g. `self.ts`, into a full healpy map with `self.nside`.
+        :param values: Array with one entry per test source
+        :param fill_value: Value of pixels which have not been tested
+        :return: np.ndarray of length `npix`
+        """
+
+        import healpy as hp
+
+        if self.pix_test is None:
+            raise ValueError("Test sources have not been generated from healpy pixels.")
+        values = np.asarray(values)
+        output = np.full(
+            (hp.nside2npix(self.nside),) + values.shape[1:], fill_value, dtype=values.dtype
+        )
+        output[self.pix_test] = values
+        return output
+
+    def _healpix_coordinates(self):
+        """
+        Coordinates of all pixels of a healpy map with `self.nside`, in ring ordering.
+        Cached in the data directory, s.t. they are only calculated once for each nside.
+        :return: Tuple of ra, dec in radians
+        """
+
+        import healpy as hp
+
+        path = os.path.join(data_directory, f"healpix_radec_nside{self.nside}.npy")
+        if os.path.isfile(path):
+            radec = np.load(path, mmap_mode="r")
+        else:
+            theta, phi = hp.pix2ang(
+                self.nside, np.arange(hp.nside2npix(self.nside)), nest=False
+            )
+            radec = np.stack(spherical_to_icrs(theta, phi))
+            os.makedirs(data_directory, exist_ok=True)
+            # Write to a temporary file first, s.t. concurrent scans never load incomplete files
+            tmp_path = f"{path}.{os.getpid()}.tmp"
+            with open(tmp_path, "wb") as f:
+                np.save(f, radec)
+            os.replace(tmp_path, path)
+        return radec[0], radec[1]
+
     def _make_output_arrays(self):
         """
         Creates output arrays based on ra, dec lists.
@@ -460,28 +773,25 @@ class MapScan(PointSourceAnalysis):
         Apply cuts of energy and dec that are provided in the yaml config.
         Actual cuts are only applied to displayed data of `self.events`
         in terms of masked properties. All data stored in private variables
-        stays in place.
+        stays in place. The mask of each period is a boolean array.
         """
 
         mask = {}
         self.events.mask = None
         try:
             for p in self._irf_periods:
-                events = self.events.period(p)
-                mask[p] = np.nonzero(
-                    (
-                        (events["reco_energy"] > self.northern_emin)
-                        & (events["dec"] >= np.deg2rad(10))
-                    )
-                    | (
-                        (events["reco_energy"] > self.equator_emin)
-                        & (events["dec"] < np.deg2rad(10))
-                        & (events["dec"] > np.deg2rad(-10))
-                    )
-                    | (
-                        (events["reco_energy"] > self.southern_emin)
-                        & (events["dec"] <= np.deg2rad(-10))
-                    )
+                dec = self.events._dec[p]
+                reco_energy = self.events._reco_energy[p]
+                northern = dec >= _DEC_HORIZON
+                southern = dec <= -_DEC_HORIZON
+                mask[p] = np.where(
+                    northern,
+                    reco_energy > self.northern_emin,
+                    np.where(
+                        southern,
+                        reco_energy > self.southern_emin,
+                        reco_energy > self.equator_emin,
+                    ),
                 )
             self.events.mask = mask
         except AttributeError:
@@ -662,15 +972,15 @@ class MapScanTSDistribution(MapScan):
 
         logger.info("Performing scan for periods: {}".format(self.events.periods))
         self.events.seed = self.seed
-        dec = self.events.dec
-        reco_energy = self.events.reco_energy
-        ang_err = self.events.ang_err
+        dec = self._contiguous(self.events.dec)
+        reco_energy = self._contiguous(self.events.reco_energy)
+        ang_err = self._contiguous(self.events.ang_err)
         if show_progress:
             for c in progress_bar(range(self.ntrials)):
                 while True:
                     # repeat until a fit has converged
                     self.events.scramble_ra()
-                    ra = self.events.ra
+                    ra = self._contiguous(self.events.ra)
                     self._test_source(
                         (self.ra_test[0], self.dec_test[0]),
                         c,
@@ -691,7 +1001,7 @@ class MapScanTSDistribution(MapScan):
                 while True:
                     # repeat until a fit has converged
                     self.events.scramble_ra()
-                    ra = self.events.ra
+                    ra = self._contiguous(self.events.ra)
                     self._test_source(
                         (self.ra_test[0], self.dec_test[0]),
                         c,
@@ -721,9 +1031,10 @@ class MapScanTSDistribution(MapScan):
         if show_progress:
             for c in progress_bar(range(self.ntrials)):
                 while True:
-                    self.sim.run(self.N, seed=self.seed + c)
+                    self.sim.run(self.Nex, seed=self.seed + c)
                     self._test_source(
                         (self.ra_test[0], self.dec_test[0]),
+                        c,
                         self.sim.ra,
                         self.sim.dec,
                         self.sim.reco_energy,
@@ -740,9 +1051,10 @@ class MapScanTSDistribution(MapScan):
             for c in range(self.ntrials):
                 while True:
                     # repeat until a fit has converged
-                    self.sim.run(self.N, seed=self.seed + c)
+                    self.sim.run(self.Nex, seed=self.seed + c)
                     self._test_source(
                         (self.ra_test[0], self.dec_test[0]),
+                        c,
                         self.sim.ra,
                         self.sim.dec,
                         self.sim.reco_energy,
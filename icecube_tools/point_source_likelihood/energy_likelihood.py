@@ -23,6 +23,26 @@ Northern sky muon neutrinos.
 """
 
 
+def equal_bin_index(x, bins: np.ndarray, inv_width: float):
+    """
+    Find the bin of x for equally spaced bins by arithmetic instead of a binary search.
+    Same as np.digitize(x, bins) - 1 for values inside the bins,
+    values outside are assigned to the first or last bin.
+    :param x: Value(s), float or np.ndarray
+    :param bins: Equally spaced bin edges
+    :param inv_width: Inverse of the bin width
+    :return: Bin index, int or np.ndarray
+    """
+
+    x = np.asarray(x)
+    nbins = bins.size - 1
+    idx = np.clip(((x - bins[0]) * inv_width).astype(np.intp), 0, nbins - 1)
+    # Values on or next to a bin edge may be rounded into the neighbouring bin, compare to the edges
+    idx = idx + ((x >= bins[idx + 1]) & (idx < nbins - 1))
+    idx = idx - ((x < bins[idx]) & (idx > 0))
+    return idx
+
+
 class MarginalisedEnergyLikelihood(ABC):
     """
     Abstract base class for the marginalised energy likelihood.
@@ -85,8 +105,9 @@ class MarginalisedIntegratedEnergyLikelihood(MarginalisedEnergyLikelihood):
         self._min_index = min_index
         self._max_index = max_index
         self.true_bins_c = self.true_energy_bins[:-1] + 0.5 * np.diff(self.true_energy_bins)
-        self._previous_index = None
+        # Cache of likelihood values, keyed by index and then declination bin
         self._values = {}
+        self._cache_size = 10
         if self._irf_period == "IC86_II":
             self._events = RealEvents.from_event_files("IC86_II", use_all=True)
         else:
@@ -110,8 +131,9 @@ class MarginalisedIntegratedEnergyLikelihood(MarginalisedEnergyLikelihood):
         dec: np.ndarray) -> np.ndarray:
         """
         Wrapper on _calc_likelihood to retrieve only the likelihood for a specific Ereco value.
-        Saves time by storing data and checking if data of the same index is requested
-        over and over again, as is done in point_source_likelihood.py for each event.
+        Saves time by storing the likelihood of the most recently requested indices
+        and declination bins, as the same index is requested over and over again
+        in point_source_likelihood.py while the minimizer is running.
         :param ereco: Reconstructed energy in GeV, float or np.ndarray
         :param index: Spectral index > 0
         :param dec: Declination, rad
@@ -135,19 +157,30 @@ class MarginalisedIntegratedEnergyLikelihood(MarginalisedEnergyLikelihood):
         dec_ind = np.digitize(dec, self.declination_bins_aeff) - 1 # is np.ndarray
         dec_ind_set = set(dec_ind)
 
+        values = self._values.pop(index, None)
+        if values is None:
+            if len(self._values) >= self._cache_size:
+                # drop the least recently used index
+                self._values.pop(next(iter(self._values)))
+            values = {}
+        # (re-)insert at the end, s.t. frequently requested indices, e.g. of the background, stay cached
+        self._values[index] = values
+
         # output array, one entry for each queried ereco
-        output = np.zeros_like(log_ereco)   # not-ok energies have zero probability returned, log is someone else's problem
+        # float64 output, also for float32 energies
+        output = np.zeros(log_ereco.shape)   # not-ok energies have zero probability returned, log is someone else's problem
         # loop over set(sec_ind):
         for dec_idx in dec_ind_set:
-            # get declination of index
-            single_dec = self.declination_bins_aeff[dec_idx]
-            if dec_idx == 0:
-                single_dec += 0.01     # necessary bc of np.digitize's left/right,
-                                       # would lead to evaluation of upper bound in flipped array -> forbidden
-            # for the queried dec index, calculate the likelihood
-            self._values[dec_idx] = self._calc_likelihood(index, single_dec)
+            if dec_idx not in values:
+                # get declination of index
+                single_dec = self.declination_bins_aeff[dec_idx]
+                if dec_idx == 0:
+                    single_dec += 0.01     # necessary bc of np.digitize's left/right,
+                                           # would lead to evaluation of upper bound in flipped array -> forbidden
+                # for the queried dec index, calculate the likelihood
+                values[dec_idx] = self._calc_likelihood(index, single_dec)
             needed = np.nonzero((dec_ind == dec_idx))
-            output[needed] = self._values[dec_idx][reco_ind[needed]]
+            output[needed] = values[dec_idx][reco_ind[needed]]
 
         return output
 
@@ -341,6 +374,7 @@ class MarginalisedEnergyLikelihood2021(MarginalisedEnergyLikelihood):
         self._min_sind = min_sind
         self._max_sind = max_sind
         self._Ebins = Ebins
+        self._inv_dlogE = (self._energy_bins.size - 1) / (self._energy_bins[-1] - self._energy_bins[0])
        
 
     def __call__(self, E, index, dec=0):
@@ -359,7 +393,7 @@ class MarginalisedEnergyLikelihood2021(MarginalisedEnergyLikelihood):
 
         if index not in self.index_list:
             raise ValueError("Only indices with simulation are allowed.")
-        idx = np.digitize(np.log10(E), self._energy_bins) - 1
+        idx = equal_bin_index(np.log10(E), self._energy_bins, self._inv_dlogE)
         
 
         index_index = np.digitize(index, self.index_list) - 1
@@ -503,12 +537,16 @@ class MarginalisedEnergyLikelihoodFromSimFixedIndex(MarginalisedEnergyLikelihood
 
         self._energy = energy
         self._dec = dec
+        # Does not change with the source declination
+        self._sin_dec = np.sin(dec)
+        self._log_energy = np.log10(energy)
         self._sim_index = sim_index
         self._min_E = min_E
         self._max_E = max_E
         self._min_sind=min_sind
         self._max_sind=max_sind
         self._energy_bins = np.linspace(np.log10(min_E), np.log10(max_E), Ebins)  # GeV
+        self._inv_dlogE = (Ebins - 1) / (np.log10(max_E) - np.log10(min_E))
         self._sin_dec_bins = np.linspace(min_sind, max_sind, 20)
         self.src_dec = src_dec
 
@@ -520,7 +558,7 @@ class MarginalisedEnergyLikelihoodFromSimFixedIndex(MarginalisedEnergyLikelihood
         :return: Likelihood
         """
 
-        idx = np.digitize(np.log10(E), self._energy_bins) - 1
+        idx = equal_bin_index(np.log10(E), self._energy_bins, self._inv_dlogE)
         return self.likelihood[idx]
 
 
@@ -542,12 +580,12 @@ class MarginalisedEnergyLikelihoodFromSimFixedIndex(MarginalisedEnergyLikelihood
         """
 
         sind_idx = np.digitize(np.sin(self._src_dec), self._sin_dec_bins) - 1
-        idx = (np.sin(self._dec) >= self._sin_dec_bins[sind_idx]) & (
-            np.sin(self._dec) < self._sin_dec_bins[sind_idx + 1]
+        idx = (self._sin_dec >= self._sin_dec_bins[sind_idx]) & (
+            self._sin_dec < self._sin_dec_bins[sind_idx + 1]
         )
         self._selected_energy = self._energy[idx]
         self.likelihood, _ = np.histogram(
-                np.log10(self._selected_energy),
+                self._log_energy[idx],
                 bins=self._energy_bins,
                 density=True
         )
@@ -588,6 +626,11 @@ class MarginalisedEnergyLikelihoodFromSim(MarginalisedEnergyLikelihood):
 
         self._dec = dec
 
+        # Neither changes with the source declination or spectral index
+        self._sin_dec = np.sin(dec)
+
+        self._log_energy = np.log10(energy)
+
         self._sim_index = sim_index
 
         self._min_index = min_index
@@ -600,10 +643,14 @@ class MarginalisedEnergyLikelihoodFromSim(MarginalisedEnergyLikelihood):
 
         self._energy_bins = np.linspace(np.log10(min_E), np.log10(max_E), Ebins)  # GeV
 
+        self._inv_dlogE = (Ebins - 1) / (np.log10(max_E) - np.log10(min_E))
+
         self._sin_dec_bins = np.linspace(min_sind, max_sind, 20)
 
         self._src_dec = None
 
+        self._index_grid = None
+
 
     def set_src_dec(self, src_dec):
         """
@@ -615,6 +662,38 @@ class MarginalisedEnergyLikelihoodFromSim(MarginalisedEnergyLikelihood):
 
         self._precompute_histograms()
 
+    def precompute_grid(self, indices):
+        """
+        Evaluate the histograms at the given spectral indices instead of at the
+        centres of the index bins. Calls then interpolate linearly between the two
+        grid points bracketing the requested index, s.t. the likelihood is continuous
+        in the index, e.g. for the minimiser.
+        The grid has to cover all accepted indices, outside of it the likelihood would be flat.
+        :param indices: Grid of spectral indices, e.g. np.arange(1.5, 4.05, 0.05)
+        """
+
+        index_grid = np.sort(np.asarray(indices, dtype=float))
+
+        if index_grid.size < 2:
+            raise ValueError("At least two grid points are needed for interpolation")
+
+        if index_grid[0] > self._min_index or index_grid[-1] < self._max_index:
+            raise ValueError(
+                "Grid of spectral indices between "
+                + str(index_grid[0])
+                + " and "
+                + str(index_grid[-1])
+                + " does not cover the accepted range between "
+                + str(self._min_index)
+                + " and "
+                + str(self._max_index)
+            )
+
+        self._index_grid = index_grid
+
+        if self._src_dec is not None:
+            self._precompute_histograms()
+
     def _calc_weights(self, new_index):
         """
         Only compute one simulation with some given spectral index, num=index_bins.
@@ -636,38 +715,49 @@ class MarginalisedEnergyLikelihoodFromSim(MarginalisedEnergyLikelihood):
         index of sin(dec) of source in list of sin(dec) sourrounding source
         energy is list of all Ereco from simulated events, index (idx) those who belong to correct declinations
         _selected_energy then contains all Ereco belonging to the selected events
-        get index bin center
+        get index bin centers, or the grid points set by `precompute_grid`
         create histogram (i.e. probability of finding some Ereco for given spectral index) for each spectral index
         """
         #TODO maybe change the sin(dec) bins to something more like +/- specified range?
         #what if src dec is right at a bin edge? too many events discarded!
-        self._likelihood = np.zeros(
-            (len(self._index_bins[:-1]), len(self._energy_bins[:-1]))
-        )
+        if self._index_grid is None:
+            indices = 0.5 * (self._index_bins[:-1] + self._index_bins[1:])
+        else:
+            indices = self._index_grid
+
+        nbins = self._energy_bins.size - 1
+
+        self._likelihood = np.zeros((indices.size, nbins))
 
         sind_idx = np.digitize(np.sin(self._src_dec), self._sin_dec_bins) - 1
 
         #only use events within the declination band hosting the source
-        idx = (np.sin(self._dec) >= self._sin_dec_bins[sind_idx]) & (
-            np.sin(self._dec) < self._sin_dec_bins[sind_idx + 1]
+        idx = (self._sin_dec >= self._sin_dec_bins[sind_idx]) & (
+            self._sin_dec < self._sin_dec_bins[sind_idx + 1]
         )
 
-        self._selected_energy = self._energy[idx]
+        # Same events as np.histogram would count
+        selected_log_energy = self._log_energy[idx]
+        in_range = (selected_log_energy >= self._energy_bins[0]) & (
+            selected_log_energy <= self._energy_bins[-1]
+        )
 
-        for i, index in enumerate(self._index_bins[:-1]):
+        self._selected_energy = self._energy[idx][in_range]
 
-            index_cen = index + (self._index_bins[i + 1] - index) / 2
+        # Energy bins do not depend on the index, only the weights do
+        E_index = equal_bin_index(
+            selected_log_energy[in_range], self._energy_bins, self._inv_dlogE
+        )
 
-            weights = self._calc_weights(index_cen)
+        bin_width = np.diff(self._energy_bins)
 
-            hist, _ = np.histogram(
-                np.log10(self._selected_energy),
-                bins=self._energy_bins,
-                weights=weights,
-                density=True,
-            )
+        for i, index in enumerate(indices):
 
-            self._likelihood[i] = hist
+            weights = self._calc_weights(index)
+
+            hist = np.bincount(E_index, weights=weights, minlength=nbins)
+
+            self._likelihood[i] = hist / (np.sum(hist) * bin_width)
 
     def __call__(self, E, new_index, dec):
         """
@@ -675,7 +765,7 @@ class MarginalisedEnergyLikelihoodFromSim(MarginalisedEnergyLikelihood):
         """
 
         #check for E out of bounds
-        if E < self._min_E or E > self._max_E:
+        if np.any(E < self._min_E) or np.any(E > self._max_E):
 
             raise ValueError(
                 "Energy "
@@ -698,11 +788,27 @@ class MarginalisedEnergyLikelihoodFromSim(MarginalisedEnergyLikelihood):
                 + str(self._max_index)
             )
 
-        i_index = np.digitize(new_index, self._index_bins) - 1
+        E_index = equal_bin_index(np.log10(E), self._energy_bins, self._inv_dlogE)
+
+        if self._index_grid is None:
+
+            i_index = np.digitize(new_index, self._index_bins) - 1
+
+            return self._likelihood[i_index, E_index]
 
-        E_index = np.digitize(np.log10(E), self._energy_bins) - 1
+        i_index = np.clip(
+            np.searchsorted(self._index_grid, new_index, side="right") - 1,
+            0,
+            self._index_grid.size - 2,
+        )
+
+        low, high = self._index_grid[i_index], self._index_grid[i_index + 1]
 
-        return self._likelihood[i_index][E_index]
+        frac = np.clip((new_index - low) / (high - low), 0.0, 1.0)
+
+        return (1.0 - frac) * self._likelihood[i_index, E_index] + frac * self._likelihood[
+            i_index + 1, E_index
+        ]
 
 
 class MarginalisedEnergyLikelihoodFixed(MarginalisedEnergyLikelihood):
@@ -739,6 +845,8 @@ class MarginalisedEnergyLikelihoodFixed(MarginalisedEnergyLikelihood):
 
         self._energy_bins = np.linspace(np.log10(min_E), np.log10(max_E), Ebins)  # GeV
 
+        self._inv_dlogE = (Ebins - 1) / (np.log10(max_E) - np.log10(min_E))
+
         self._precompute_histogram()
 
     def _precompute_histogram(self):
@@ -751,7 +859,7 @@ class MarginalisedEnergyLikelihoodFixed(MarginalisedEnergyLikelihood):
 
     def __call__(self, E):
 
-        E_index = np.digitize(np.log10(E), self._energy_bins) - 1
+        E_index = equal_bin_index(np.log10(E), self._energy_bins, self._inv_dlogE)
 
         return self._likelihood[E_index]
 
@@ -1,5 +1,4 @@
 import numpy as np
-from iminuit import Minuit
 import logging
 
 from .energy_likelihood import *
@@ -10,6 +9,7 @@ from ..source.flux_model import PowerLawFlux
 from ..neutrino_calculator import NeutrinoCalculator
 from ..detector.detector import TimeDependentIceCube
 from ..utils.data import Uptime
+from ..utils.coordinate_transforms import angular_separation
 
 from typing import Dict, List, Tuple, Sequence
 from collections import OrderedDict
@@ -31,6 +31,34 @@ logger = logging.getLogger(__name__)
 logger.setLevel(logging.WARNING)
 
 
+def log_likelihood_ratio_sum(alpha_i: np.ndarray) -> float:
+    """
+    Sum of log(1 + alpha_i) over all events, evaluated in a single pass.
+    Below `1 + alpha_i = 1e-10` the logarithm is replaced by its second order
+    Taylor expansion to keep the minimiser away from the singularity.
+
+    Uses calculation described in:
+    https://github.com/IceCubeOpenSource/SkyLLH/blob/master/doc/user_manual.pdf
+
+    :param alpha_i: ns * chi_i for each selected event
+    :return: Summed log likelihood ratio
+    """
+
+    one_plus_alpha = 1e-10
+    alpha = one_plus_alpha - 1
+
+    alpha_i = np.asarray(alpha_i, dtype=float)
+    log_likelihood_ratio = np.empty(alpha_i.shape)
+
+    one_p = 1 + alpha_i < one_plus_alpha
+
+    alpha_tilde = (alpha_i[one_p] - alpha) / one_plus_alpha
+    log_likelihood_ratio[one_p] = np.log1p(alpha) + alpha_tilde - 0.5 * np.power(alpha_tilde, 2)
+    log_likelihood_ratio[~one_p] = np.log1p(alpha_i[~one_p])
+
+    return np.sum(log_likelihood_ratio)
+
+
 class PointSourceLikelihood:
     """
     Calculate the point source likelihood for a given
@@ -116,15 +144,11 @@ class PointSourceLikelihood:
             )  # degrees
 
         
-        self._ras = ras
-
-        self._decs = decs
-
-        self._energies = energies
-
         self._index_prior = index_prior
 
-        self._ang_errs = ang_errs
+        self._dec_source = None
+
+        self._set_events(ras, decs, energies, ang_errs)
 
         self.source_coord = source_coord    # moved select_nearby_events into setter
 
@@ -152,18 +176,7 @@ class PointSourceLikelihood:
         src_dec = self.source_coord[1]
         ra = self._selected_ras
         dec = self._selected_decs
-        cos_r = np.cos(src_ra - ra) * np.cos(src_dec) * np.cos(dec) + np.sin(
-            src_dec
-        ) * np.sin(dec)
-
-        # Handle possible floating precision errors.
-        idx = np.nonzero((cos_r < -1.0))
-        cos_r[idx] = 1.0
-        idx = np.nonzero((cos_r > 1.0))
-        cos_r[idx] = 1.0
-
-        r = np.arccos(cos_r)
-        return r
+        return angular_separation(src_ra, src_dec, ra, dec, self._selected_cos_decs)
 
 
     @property
@@ -238,45 +251,71 @@ class PointSourceLikelihood:
         Provide new events and call `self._select_nearby_events()`
         """
         
-        self._ras = ra
-        self._decs = dec
-        self._energies = reco_energy
-        self._ang_errs = ang_err
+        self._set_events(ra, dec, reco_energy, ang_err)
         self._select_nearby_events()
 
 
+    def _set_events(self, ra, dec, reco_energy, ang_err):
+        """
+        Store events sorted by declination, s.t. the declination band
+        around each source can be found by a binary search.
+        If `dec` is the same array as for the previous events, e.g. for RA-scrambled trials,
+        the previous order is reused. Arrays of events are not expected to be modified in place.
+        """
+
+        if dec is not self._dec_source:
+            self._dec_source = dec
+            self._order = np.argsort(dec, kind="stable")
+            self._decs = np.asarray(dec)[self._order]
+            # Events are compared to many sources, only evaluate cos(dec) once
+            self._cos_decs = np.cos(self._decs)
+        order = self._order
+        self._ras = np.asarray(ra)[order]
+        self._energies = np.asarray(reco_energy)[order]
+        if isinstance(ang_err, np.ndarray):
+            self._ang_errs = ang_err[order]
+        else:
+            self._ang_errs = ang_err
+
+
     def _select_nearby_events(self):
         """
         Select events used in analysis nearby the source.
         """
 
+        # Events are sorted by declination, only the RA of events inside the declination band is checked.
+        # Bounds are given the dtype of the events, else numpy casts all events for the search.
+        # Rounding the bounds inwards onto that dtype selects exactly the events within the band.
+        dec_type = self._decs.dtype.type
+        dec_low = dec_type(self._dec_low)
+        if dec_low < self._dec_low:
+            dec_low = np.nextafter(dec_low, dec_type(np.inf))
+        dec_high = dec_type(self._dec_high)
+        if dec_high > self._dec_high:
+            dec_high = np.nextafter(dec_high, dec_type(-np.inf))
+        band_low = np.searchsorted(self._decs, dec_low, side="left")
+        band_high = np.searchsorted(self._decs, dec_high, side="right")
+        ras = self._ras[band_low:band_high]
+
         if self._ra_low < 0.:
             selected = np.nonzero((
-                (self._decs >= self._dec_low)
-                & (self._decs <= self._dec_high)
-                & (((self._ras >= 0.) & (self._ras <= self._ra_high))
+                ((ras >= 0.) & (ras <= self._ra_high))
                 # include all events that are close to the source
                 # from the `other side of 2pi´ someone call a mathematician, how do you properly say that?
                 # 2pi ambiguity?
-                | ((self._ras >= self._ra_low + 2 * np.pi) & (self._ras <= 2 * np.pi)))
+                | ((ras >= self._ra_low + 2 * np.pi) & (ras <= 2 * np.pi))
             ))
         elif self._ra_high > 2 * np.pi:
             selected = np.nonzero((
-                (self._decs >= self._dec_low)
-                & (self._decs <= self._dec_high)
-                & (((self._ras <= 2 * np.pi) & (self._ras >= self._ra_low))
-                | ((self._ras >= 0.) & (self._ras <= self._ra_high - 2 * np.pi)))
+                ((ras <= 2 * np.pi) & (ras >= self._ra_low))
+                | ((ras >= 0.) & (ras <= self._ra_high - 2 * np.pi))
             ))
         else:
             selected = np.nonzero((
-                        (self._decs >= self._dec_low)
-                        & (self._decs <= self._dec_high)
-                        & (self._ras >= self._ra_low)
-                        & (self._ras <= self._ra_high))
+                        (ras >= self._ra_low)
+                        & (ras <= self._ra_high))
                     )
-        selected_dec_band = np.nonzero((
-                    (self._decs >= self._dec_low) & (self._decs <= self._dec_high))
-                )
+        selected = (selected[0] + band_low,)
 
         self._selected = selected
 
@@ -284,6 +323,8 @@ class PointSourceLikelihood:
 
         self._selected_decs = self._decs[selected]
 
+        self._selected_cos_decs = self._cos_decs[selected]
+
         self._selected_energies = self._energies[selected]
 
         self._selected_bg_energies = self._energies#[selected_dec_band]
@@ -307,7 +348,8 @@ class PointSourceLikelihood:
                 self._selected_ang_errs,
                 self._selected_ras,
                 self._selected_decs, 
-                self._source_coord
+                self._source_coord,
+                cos_dec=self._selected_cos_decs,
             )
 
 
@@ -454,8 +496,6 @@ class PointSourceLikelihood:
         :return: negative log likelihood ratio over all events
         """
 
-        one_plus_alpha = 1e-10
-        alpha = one_plus_alpha - 1
         if isinstance(self._energy_likelihood, MarginalisedIntegratedEnergyLikelihood):
             index_list = [index]
         else:
@@ -464,7 +504,6 @@ class PointSourceLikelihood:
             index_list = self._energy_likelihood.index_list[idx-1:idx+1]
 
         for c, indx in enumerate(index_list):
-            log_likelihood_ratio = np.zeros_like(self._selected_ras)
             signal = self._signal_likelihood(
                 self._selected_ras,
                 self._selected_decs,
@@ -486,12 +525,7 @@ class PointSourceLikelihood:
 
             alpha_i = ns * chi
 
-            one_p = 1 + alpha_i < one_plus_alpha
-            
-            alpha_tilde = (alpha_i[one_p] - alpha) / one_plus_alpha
-            log_likelihood_ratio[one_p] = np.log1p(alpha) + alpha_tilde - 0.5 * np.power(alpha_tilde, 2)
-            log_likelihood_ratio[~one_p] = np.log1p(alpha_i[~one_p])
-            log_likelihood_ratio = np.sum(log_likelihood_ratio)
+            log_likelihood_ratio = log_likelihood_ratio_sum(alpha_i)
 
             log_likelihood_ratio += (self.N - self.Nprime) * np.log1p(-ns / self.N)
 
@@ -524,12 +558,7 @@ class PointSourceLikelihood:
         :param ns: Number of source counts.
         :param index: Dummy argument
         """
-        
-        one_plus_alpha = 1e-10
-        alpha = one_plus_alpha - 1
 
-        log_likelihood_ratio = np.zeros_like(self._selected_ras)
-        
         signal = self._signal_likelihood(
             self._selected_ras,
             self._selected_decs,
@@ -545,12 +574,7 @@ class PointSourceLikelihood:
 
         alpha_i = ns * chi
 
-        one_p = 1 + alpha_i < one_plus_alpha
-        
-        alpha_tilde = (alpha_i[one_p] - alpha) / one_plus_alpha
-        log_likelihood_ratio[one_p] = np.log1p(alpha) + alpha_tilde - 0.5 * np.power(alpha_tilde, 2)
-        log_likelihood_ratio[~one_p] = np.log1p(alpha_i[~one_p])
-        log_likelihood_ratio = np.sum(log_likelihood_ratio)
+        log_likelihood_ratio = log_likelihood_ratio_sum(alpha_i)
 
         log_likelihood_ratio += (self.N - self.Nprime) * np.log1p(-ns / self.N)
 
@@ -592,6 +616,8 @@ class PointSourceLikelihood:
         Uses the iMiuint wrapper.
         """
 
+        from iminuit import Minuit
+
         init_index = self._energy_likelihood._min_index + (self._max_index - self._energy_likelihood._min_index) / 2
         init_ns = self._ns_min + (self._ns_max - self._ns_min) / 2
         init_weight = 0.0
@@ -669,6 +695,8 @@ class PointSourceLikelihood:
         Minimize the background negative log-ikelihood only.
         """
 
+        from iminuit import Minuit
+
         init_astro = 2.5
         init_atmo = 3.3
         if astro:
@@ -741,40 +769,36 @@ class PointSourceLikelihood:
         one_plus_alpha = 1e-10
         alpha = one_plus_alpha - 1
 
-        self._first_derivative = []
-
-        for i in range(self.Nprime):
-
-            signal = self._signal_likelihood(
-                self._selected_ras[i],
-                self._selected_decs[i],
-                self._source_coord,
-                self._selected_energies[i],
-                index,
-                ang_err=self._selected_ang_errs[i],
-            )
-
-            bg = self._background_likelihood(self._selected_energies[i])
+        signal = self._signal_likelihood(
+            self._selected_ras,
+            self._selected_decs,
+            self._source_coord,
+            self._selected_energies,
+            index,
+            ang_err=self._selected_ang_errs,
+        )
 
-            chi_i = (1 / self.N) * ((signal / bg) - 1)
+        bg = self._background_likelihood(
+            self._selected_energies, self._selected_decs
+        )
 
-            alpha_i = ns * chi_i
+        chi_i = (1 / self.N) * ((signal / bg) - 1)
 
-            if (1 + alpha_i) < one_plus_alpha:
+        alpha_i = ns * chi_i
 
-                alpha_tilde = (alpha_i - alpha) / one_plus_alpha
+        self._first_derivative = np.empty(chi_i.shape)
 
-                self._first_derivative.append(
-                    (1 / one_plus_alpha) * (1 - alpha_tilde) * chi_i
-                )
+        one_p = (1 + alpha_i) < one_plus_alpha
 
-            else:
+        alpha_tilde = (alpha_i[one_p] - alpha) / one_plus_alpha
 
-                self._first_derivative.append(chi_i / (1 + alpha_i))
+        self._first_derivative[one_p] = (
+            (1 / one_plus_alpha) * (1 - alpha_tilde) * chi_i[one_p]
+        )
 
-        self._first_derivative = np.array(self._first_derivative)
+        self._first_derivative[~one_p] = chi_i[~one_p] / (1 + alpha_i[~one_p])
 
-        return sum(self._first_derivative) - ((self.N - self.Nprime) / (self.N - ns))
+        return np.sum(self._first_derivative) - ((self.N - self.Nprime) / (self.N - ns))
 
 
     def _second_derivative_likelihood_ratio(self, ns=0):
@@ -786,7 +810,7 @@ class PointSourceLikelihood:
 
         self._second_derivative = -((self._first_derivative) ** 2)
 
-        return sum(self._second_derivative) - (
+        return np.sum(self._second_derivative) - (
             (self.N - self.Nprime) / (self.N - ns) ** 2
         )
 
@@ -906,22 +930,21 @@ class SpatialOnlyPointSourceLikelihood:
 
         self._selected = selected
 
-        self._selected_event_coords = [
-            (ec[0], ec[1])
-            for ec in self._event_coords
-            if (ec[1] >= source_dec - dec_fac)
-            & (ec[1] <= source_dec + dec_fac)
-            & (ec[0] >= source_ra - dec_fac)
-            & (ec[0] <= source_ra + dec_fac)
-        ]
+        self._selected_ras = ras[selected]
+
+        self._selected_decs = decs[selected]
+
+        self._selected_event_coords = list(
+            zip(self._selected_ras, self._selected_decs)
+        )
 
         self.Nprime = len(selected)
 
         self.N = len(selected_dec_band)
 
-    def _signal_likelihood(self, event_coord, source_coord):
+    def _signal_likelihood(self, ra, dec, source_coord):
 
-        return self._direction_likelihood(event_coord, source_coord)
+        return self._direction_likelihood(ra, dec, source_coord)
 
     def _background_likelihood(self):
 
@@ -937,33 +960,17 @@ class SpatialOnlyPointSourceLikelihood:
         :param ns: Number of source counts.
         """
 
-        one_plus_alpha = 1e-10
-        alpha = one_plus_alpha - 1
-
-        log_likelihood_ratio = 0.0
-
-        for i in range(self.Nprime):
-
-            signal = self._signal_likelihood(
-                self._selected_event_coords[i], self._source_coord
-            )
-
-            bg = self._background_likelihood()
-
-            chi = (1 / self.N) * (signal / bg - 1)
-
-            alpha_i = ns * chi
+        signal = self._signal_likelihood(
+            self._selected_ras, self._selected_decs, self._source_coord
+        )
 
-            if (1 + alpha_i) < one_plus_alpha:
+        bg = self._background_likelihood()
 
-                alpha_tilde = (alpha_i - alpha) / one_plus_alpha
-                log_likelihood_ratio += (
-                    np.log1p(alpha) + alpha_tilde - (0.5 * alpha_tilde ** 2)
-                )
+        chi = (1 / self.N) * (signal / bg - 1)
 
-            else:
+        alpha_i = ns * chi
 
-                log_likelihood_ratio += np.log1p(alpha_i)
+        log_likelihood_ratio = log_likelihood_ratio_sum(alpha_i)
 
         log_likelihood_ratio += (self.N - self.Nprime) * np.log1p(-ns / self.N)
 
@@ -984,10 +991,12 @@ class SpatialOnlyPointSourceLikelihood:
         Uses the iMiuint wrapper.
         """
 
+        from iminuit import Minuit
+
         init_ns = self._ns_min + (self._ns_max - self._ns_min) / 2
         
         m = Minuit(
-            self._func_to_minimize,
+            self._get_neg_log_likelihood_ratio,
             ns=init_ns,
         )
         m.limits["ns"] = (self._ns_min, self._ns_max)
@@ -1222,6 +1231,8 @@ class TimeDependentPointSourceLikelihood:
         Uses the iMinuint wrapper.
         """
 
+        from iminuit import Minuit
+
         some_llh = self.likelihoods[list(self.likelihoods.keys())[0]]
         init_index = some_llh._min_index + (some_llh._max_index - some_llh._min_index) / 2
         limit_index = (some_llh._energy_likelihood._min_index,
@@ -1293,6 +1304,8 @@ class TimeDependentPointSourceLikelihood:
         Minimize the background negative log-ikelihood only.
         """
 
+        from iminuit import Minuit
+
         init_astro = 2.5
         init_atmo = 3.3
         if astro:
@@ -1518,7 +1531,7 @@ class EnergyDependentSpatialPointSourceLikelihood:
 
     def _signal_likelihood(self, ra, dec, source_coord, energy):
 
-        return self._direction_likelihood((ra, dec), source_coord, energy)
+        return self._direction_likelihood(ra, dec, source_coord, energy)
 
     def _background_likelihood(self):
 
@@ -1534,36 +1547,20 @@ class EnergyDependentSpatialPointSourceLikelihood:
         :param ns: Number of source counts.
         """
 
-        one_plus_alpha = 1e-10
-        alpha = one_plus_alpha - 1
-
-        log_likelihood_ratio = 0.0
-
-        for i in range(self.Nprime):
-
-            signal = self._signal_likelihood(
-                self._selected_ras[i],
-                self._selected_decs[i],
-                self._source_coord,
-                self._energies[i],
-            )
-
-            bg = self._background_likelihood()
-
-            chi = (1 / self.N) * (signal / bg - 1)
-
-            alpha_i = ns * chi
+        signal = self._signal_likelihood(
+            self._selected_ras,
+            self._selected_decs,
+            self._source_coord,
+            self._selected_energies,
+        )
 
-            if (1 + alpha_i) < one_plus_alpha:
+        bg = self._background_likelihood()
 
-                alpha_tilde = (alpha_i - alpha) / one_plus_alpha
-                log_likelihood_ratio += (
-                    np.log1p(alpha) + alpha_tilde - (0.5 * alpha_tilde ** 2)
-                )
+        chi = (1 / self.N) * (signal / bg - 1)
 
-            else:
+        alpha_i = ns * chi
 
-                log_likelihood_ratio += np.log1p(alpha_i)
+        log_likelihood_ratio = log_likelihood_ratio_sum(alpha_i)
 
         log_likelihood_ratio += (self.N - self.Nprime) * np.log1p(-ns / self.N)
 
@@ -1584,13 +1581,13 @@ class EnergyDependentSpatialPointSourceLikelihood:
         Uses the iMiuint wrapper.
         """
 
+        from iminuit import Minuit
+
         init_ns = self._ns_min + (self._ns_max - self._ns_min) / 2
-        init_index = 2.19
-        
+
         m = Minuit(
-            self._func_to_minimize,
+            self._get_neg_log_likelihood_ratio,
             ns=init_ns,
-            index=init_index,
         )
         m.limits["ns"] = (self._ns_min, self._ns_max)
         m.errors["ns"] = 1
@@ -1662,9 +1659,9 @@ class SimplePointSourceLikelihood:
 
         self.Ntot = len(self._event_coords)
 
-    def _signal_likelihood(self, event_coord, source_coord):
+    def _signal_likelihood(self, ra, dec, source_coord):
 
-        return self._direction_likelihood(event_coord, source_coord)
+        return self._direction_likelihood(ra, dec, source_coord)
 
     def _background_likelihood(self):
 
@@ -1672,6 +1669,8 @@ class SimplePointSourceLikelihood:
 
     def _select_declination_band(self):
 
+        ras = np.array([_[0] for _ in self._event_coords])
+
         decs = np.array([_[1] for _ in self._event_coords])
 
         _, source_dec = self._source_coord
@@ -1684,34 +1683,42 @@ class SimplePointSourceLikelihood:
 
         self._selected = selected
 
-        self._selected_event_coords = [
-            (ec[0], ec[1])
-            for ec in self._event_coords
-            if (ec[1] >= source_dec - dec_fac) & (ec[1] <= source_dec + dec_fac)
-        ]
+        self._selected_ras = ras[selected]
+
+        self._selected_decs = decs[selected]
+
+        self._selected_event_coords = list(
+            zip(self._selected_ras, self._selected_decs)
+        )
 
         self.N = len(selected)
 
     def __call__(self, ns):
 
-        log_likelihood = 0.0
-
-        for i in range(self.N):
+        # Evaluate all selected events at once
+        signal = self._signal_likelihood(
+            self._selected_ras, self._selected_decs, self._source_coord
+        )
 
-            signal = (ns / self.N) * self._signal_likelihood(
-                self._selected_event_coords[i], self._source_coord
-            )
+        bg = self._background_likelihood()
 
-            bg = (1 - (ns / self.N)) * self._background_likelihood()
+        # log(f * S + (1 - f) * B) = log(B) + log1p(f * (S / B - 1)),
+        # stable for events far from the source, where S / B -> 0
+        f = ns / self.N
 
-            log_likelihood += np.log(signal + bg)
+        log_likelihood = self.N * np.log(bg) + np.sum(np.log1p(f * (signal / bg - 1.0)))
 
         return -log_likelihood
 
 
 class SimpleWithEnergyPointSourceLikelihood:
     def __init__(
-        self, direction_likelihood, energy_likelihood, event_coords, source_coord
+        self,
+        direction_likelihood,
+        energy_likelihood,
+        event_coords,
+        source_coord,
+        energies,
     ):
         """
         Simple version of point source likelihood.
@@ -1727,6 +1734,8 @@ class SimpleWithEnergyPointSourceLikelihood:
 
         self._event_coords = event_coords
 
+        self._energies = np.asarray(energies)
+
         self._source_coord = source_coord
 
         self._select_declination_band()
@@ -1735,22 +1744,24 @@ class SimpleWithEnergyPointSourceLikelihood:
 
         self._bg_index = 3.7
 
-    def _signal_likelihood(self, event_coord, source_coord, energy, index):
+    def _signal_likelihood(self, ra, dec, source_coord, energy, index):
 
         return self._direction_likelihood(
-            event_coord, source_coord
-        ) * self._energy_likelihood(energy, index)
+            ra, dec, source_coord
+        ) * self._energy_likelihood(energy, index, dec)
 
-    def _background_likelihood(self, energy):
+    def _background_likelihood(self, energy, dec):
 
         return (
             1
             / (np.deg2rad(self._band_width * 2) * 2 * np.pi)
-            * self._energy_likelihood(energy, self._bg_index)
+            * self._energy_likelihood(energy, self._bg_index, dec)
         )
 
     def _select_declination_band(self):
 
+        ras = np.array([_[0] for _ in self._event_coords])
+
         decs = np.array([_[1] for _ in self._event_coords])
 
         _, source_dec = self._source_coord
@@ -1763,26 +1774,36 @@ class SimpleWithEnergyPointSourceLikelihood:
 
         self._selected = selected
 
-        self._selected_event_coords = [
-            (ec[0], ec[1])
-            for ec in self._event_coords
-            if (ec[1] >= source_dec - dec_fac) & (ec[1] <= source_dec + dec_fac)
-        ]
+        self._selected_ras = ras[selected]
 
-        self.N = len(selected)
+        self._selected_decs = decs[selected]
 
-    def __call__(self, ns):
+        self._selected_energies = self._energies[selected]
 
-        log_likelihood = 0.0
+        self._selected_event_coords = list(
+            zip(self._selected_ras, self._selected_decs)
+        )
+
+        self.N = len(selected)
 
-        for i in range(self.N):
+    def __call__(self, ns, index):
 
-            signal = (ns / self.N) * self._signal_likelihood(
-                self._selected_event_coords[i], self._source_coord
-            )
+        # Evaluate all selected events at once
+        signal = self._signal_likelihood(
+            self._selected_ras,
+            self._selected_decs,
+            self._source_coord,
+            self._selected_energies,
+            index,
+        )
+
+        bg = self._background_likelihood(
+            self._selected_energies, self._selected_decs
+        )
 
-            bg = (1 - (ns / self.N)) * self._background_likelihood()
+        # Same stable form as in `SimplePointSourceLikelihood`
+        f = ns / self.N
 
-            log_likelihood += np.log(signal + bg)
+        log_likelihood = np.sum(np.log(bg)) + np.sum(np.log1p(f * (signal / bg - 1.0)))
 
         return -log_likelihood
@@ -4,6 +4,7 @@ from typing import Tuple
 from scipy.stats import rv_histogram
 
 from ..utils.data import RealEvents
+from ..utils.coordinate_transforms import angular_separation
 from ..detector.effective_area import EffectiveArea
 
 
@@ -49,6 +50,7 @@ class EventDependentSpatialGaussianLikelihood(SpatialLikelihood):
         ra: np.ndarray,
         dec: np.ndarray,
         source_coord: Tuple[float, float],
+        cos_dec: np.ndarray = None,
     ):
         """
         Use the neutrino energy to determine sigma and
@@ -60,31 +62,23 @@ class EventDependentSpatialGaussianLikelihood(SpatialLikelihood):
         :param ra: RAs of events, in rad
         :param dec: DECs of events, in rad
         :param source_coord: Tuple (ra, dec) of point source [rad].
+        :param cos_dec: Optional precomputed cos(dec) of events
         """
 
-        sigma_rad = np.deg2rad(ang_err)
+        # Likelihood is evaluated in double precision, also for float32 events
+        sigma_rad = np.deg2rad(np.asarray(ang_err, dtype=float))
 
         src_ra, src_dec = source_coord
 
         norm = 0.5 / (np.pi * sigma_rad**2)
 
-        # Calculate the cosine of the distance of the source and the event on
-        # the sphere.
-        cos_r = np.cos(src_ra - ra) * np.cos(src_dec) * np.cos(dec) + np.sin(
-            src_dec
-        ) * np.sin(dec)
-
-        # Handle possible floating precision errors.
-        idx = np.nonzero((cos_r < -1.0))
-        cos_r[idx] = 1.0
-        idx = np.nonzero((cos_r > 1.0))
-        cos_r[idx] = 1.0
-
-        r = np.arccos(cos_r)
+        # Calculate the distance of the source and the event on the sphere.
+        r = angular_separation(src_ra, src_dec, ra, dec, cos_dec)
 
         dist = np.exp(-0.5 * (r / sigma_rad) ** 2)
 
-        return r / np.sin(r) * norm * dist
+        # r / sin(r), finite for r = 0
+        return norm * dist / np.sinc(r / np.pi)
 
 
 class DataDrivenBackgroundSpatialLikelihood(SpatialLikelihood):
@@ -143,29 +137,23 @@ class SpatialGaussianLikelihood(SpatialLikelihood):
 
         P(x_i | x_s) = (1 / (2pi * sigma^2)) * exp( |x_i - x_s|^2/ (2*sigma^2) )
 
-        :param event_coord: (ra, dec) of event [rad].
+        :param ra: RA of events [rad], float or np.ndarray.
+        :param dec: DEC of events [rad], float or np.ndarray.
         :param source_coord: (ra, dec) of point source [rad].
+        :return: Likelihood for each provided event
         """
 
+        ra = np.asarray(ra)
+        dec = np.asarray(dec)
+
         sigma_rad = np.deg2rad(self._sigma)
 
         src_ra, src_dec = source_coord
 
         norm = 0.5 / (np.pi * sigma_rad**2)
 
-        # Calculate the cosine of the distance of the source and the event on
-        # the sphere.
-        cos_r = np.cos(src_ra - ra) * np.cos(src_dec) * np.cos(dec) + np.sin(
-            src_dec
-        ) * np.sin(dec)
-
-        # Handle possible floating precision errors.
-        idx = np.nonzero((cos_r < -1.0))
-        cos_r[idx] = 1.0
-        idx = np.nonzero((cos_r > 1.0))
-        cos_r[idx] = 1.0
-
-        r = np.arccos(cos_r)
+        # Calculate the distance of the source and the event on the sphere.
+        r = angular_separation(src_ra, src_dec, ra, dec)
 
         dist = np.exp(-0.5 * (r / sigma_rad) ** 2)
 
@@ -204,16 +192,23 @@ class EnergyDependentSpatialGaussianLikelihood(SpatialLikelihood):
         Return the expected angular resolution for a
         given reconstrcuted energy and spectral index.
 
-        :param reco_energy: Reconstructed energy [GeV]
+        :param reco_energy: Reconstructed energy [GeV], float or np.ndarray
         :param index: Spectral index
         """
 
-        ang_res_at_Ereco = [
+        ang_res_at_Ereco = np.array([
             ang_res._get_angular_resolution(reco_energy)
             for ang_res in self._angular_resolution_list
+        ])
+
+        # Interpolation is linear in the angular resolutions,
+        # find the weight of each index once and apply it to all energies
+        weights = [
+            np.interp(index, self._index_list, w)
+            for w in np.eye(len(self._index_list))
         ]
 
-        ang_res_at_index = np.interp(index, self._index_list, ang_res_at_Ereco)
+        ang_res_at_index = np.dot(weights, ang_res_at_Ereco)
 
         return ang_res_at_index
 
@@ -233,37 +228,25 @@ class EnergyDependentSpatialGaussianLikelihood(SpatialLikelihood):
 
     def __call__(self, ra, dec, source_coord, reco_energy, index=2.0):
         """
-        Evaluate PDF for a given event.
+        Evaluate PDF for all given events.
 
-        :param event_coord: (ra, dec) coordinates of event
+        :param ra: RA of events [rad], float or np.ndarray
+        :param dec: DEC of events [rad], float or np.ndarray
         :param source_coord: (ra, dec) coordinates of source
-        :param reco_energy: Reconstructed energy [GeV]
+        :param reco_energy: Reconstructed energy [GeV], float or np.ndarray
         :param index: Spectral index of source
+        :return: Likelihood for each provided event
         """
-        output = np.zeros_like(ra)
-        src_ra, src_dec = source_coord
-        for c, (r, d, e) in enumerate(zip(ra, dec, reco_energy)):
-
-            sigma_rad = np.deg2rad(self._get_sigma(e, index))
-
-            norm = 0.5 / (np.pi * sigma_rad**2)
 
-            # Calculate the cosine of the distance of the source and the event on
-            # the sphere.
-            cos_r = np.cos(src_ra - r) * np.cos(src_dec) * np.cos(d) + np.sin(
-                src_dec
-            ) * np.sin(d)
+        sigma_rad = np.deg2rad(np.asarray(self._get_sigma(reco_energy, index), dtype=float))
 
-            # Handle possible floating precision errors.
-            if cos_r < -1.0:
-                cos_r = 1.0
-            if cos_r > 1.0:
-                cos_r = 1.0
+        src_ra, src_dec = source_coord
 
-            r = np.arccos(cos_r)
+        norm = 0.5 / (np.pi * sigma_rad**2)
 
-            dist = np.exp(-0.5 * (r / sigma_rad) ** 2)
+        # Calculate the distance of the source and the event on the sphere.
+        r = angular_separation(src_ra, src_dec, ra, dec)
 
-            output[c] = dist * norm
+        dist = np.exp(-0.5 * (r / sigma_rad) ** 2)
 
-        return output
+        return dist * norm
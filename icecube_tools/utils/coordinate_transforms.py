@@ -15,4 +15,19 @@ def spherical_to_cart(r, theta, phi):
     x = r * np.sin(theta) * np.cos(phi)
     y = r * np.sin(theta) * np.sin(phi)
     z = r * np.cos(theta)
-    return x, y, z
\ No newline at end of file
+    return x, y, z
+
+def angular_separation(ra1, dec1, ra2, dec2, cos_dec2=None):
+    """
+    Great circle distance between points on the sphere, using the haversine
+    formula, which stays accurate for small separations. All angles in rad.
+    cos(dec2) can be provided if it is precomputed, e.g. for events
+    that are compared to many sources.
+    """
+    if cos_dec2 is None:
+        cos_dec2 = np.cos(dec2)
+    a = np.sin(0.5 * (dec2 - dec1)) ** 2 + np.cos(dec1) * cos_dec2 * np.sin(
+        0.5 * (ra2 - ra1)
+    ) ** 2
+    # Guard against floating precision errors close to antipodal points
+    return 2 * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
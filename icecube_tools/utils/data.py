@@ -747,7 +747,7 @@ class SimEvents(Events):
             num_of_events += self._ra[p].size
             if self.mask:
                 self._ra[p][self.mask[p]] = self.rng.uniform(
-                    low=0.0, high=2 * np.pi, size=self.mask[p].size
+                    low=0.0, high=2 * np.pi, size=self._ra[p][self.mask[p]].size
                 )
             else:
                 self._ra[p] = self.rng.uniform(
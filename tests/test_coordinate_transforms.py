@@ -0,0 +1,59 @@
+from icecube_tools.utils.coordinate_transforms import angular_separation
+
+import numpy as np
+import pytest
+
+
+@pytest.mark.parametrize(
+    "ra1, dec1, ra2, dec2, expected",
+    [
+        (1.0, 0.3, 1.0, 0.3, 0.0),
+        (0.0, 0.0, np.pi / 2, 0.0, np.pi / 2),
+        (0.0, 0.0, 0.0, np.pi / 2, np.pi / 2),
+        (2.0, 0.3, 2.0, 0.3 + 1e-8, 1e-8),
+        (2.0, 0.0, 2.0 + 1e-8, 0.0, 1e-8),
+        (0.0, 0.0, np.pi, 0.0, np.pi),
+        (1.0, np.pi / 2, 1.0, -np.pi / 2, np.pi),
+        (0.5, 0.4, 0.5 + np.pi, -0.4, np.pi),
+    ],
+)
+def test_angular_separation(ra1, dec1, ra2, dec2, expected):
+
+    separation = angular_separation(ra1, dec1, ra2, dec2)
+
+    assert np.isfinite(separation)
+    assert separation == pytest.approx(expected, rel=1e-6, abs=1e-15)
+
+
+def test_angular_separation_small():
+
+    # Small offsets from the source, dec by dx and ra by dy / cos(dec)
+    dec = 0.6
+    dx, dy = 3e-9, 4e-9
+    separation = angular_separation(1.0, dec, 1.0 + dy / np.cos(dec), dec + dx)
+
+    assert separation == pytest.approx(5e-9, rel=1e-6)
+
+
+def test_angular_separation_vectorised():
+
+    rng = np.random.default_rng(42)
+    ra = rng.uniform(0, 2 * np.pi, 1000)
+    dec = np.arcsin(rng.uniform(-1, 1, 1000))
+
+    separation = angular_separation(1.0, 0.3, ra, dec)
+
+    # Angle between unit vectors, also accurate for all separations
+    def vec(ra, dec):
+        return np.stack(
+            [np.cos(dec) * np.cos(ra), np.cos(dec) * np.sin(ra), np.sin(dec)], axis=-1
+        )
+
+    a = vec(1.0, 0.3)
+    b = vec(ra, dec)
+    expected = np.arctan2(np.linalg.norm(np.cross(a, b), axis=-1), b @ a)
+
+    assert np.allclose(separation, expected, rtol=1e-10, atol=1e-12)
+    assert np.allclose(
+        separation, angular_separation(1.0, 0.3, ra, dec, np.cos(dec)), rtol=1e-12
+    )
@@ -0,0 +1,110 @@
+from icecube_tools.point_source_likelihood.energy_likelihood import (
+    MarginalisedIntegratedEnergyLikelihood,
+    MarginalisedEnergyLikelihoodFromSim,
+    equal_bin_index,
+)
+
+import numpy as np
+import pytest
+
+
+def test_integrated_likelihood_cache_keeps_recently_used():
+
+    likelihood = MarginalisedIntegratedEnergyLikelihood.__new__(
+        MarginalisedIntegratedEnergyLikelihood
+    )
+    likelihood._min_index = 1.5
+    likelihood._max_index = 4.0
+    likelihood.reco_bins = np.linspace(2.0, 8.0, 13)
+    likelihood.declination_bins_aeff = np.linspace(-np.pi / 2, np.pi / 2, 4)
+    likelihood._values = {}
+    likelihood._cache_size = 3
+
+    calls = []
+
+    def calc_likelihood(index, dec):
+        calls.append(index)
+        return np.full(likelihood.reco_bins.size - 1, index)
+
+    likelihood._calc_likelihood = calc_likelihood
+
+    ereco = np.array([1e3, 1e5])
+    dec = np.array([0.1, 0.2])
+
+    # Background index is requested in between the changing source indices
+    for index in [2.0, 2.1, 2.2, 2.3, 2.4]:
+        assert np.all(likelihood(ereco, 3.7, dec) == 3.7)
+        assert np.all(likelihood(ereco, index, dec) == index)
+
+    assert calls.count(3.7) == 1
+    assert len(likelihood._values) == 3
+
+
+@pytest.mark.parametrize("low, high, num", [(2.0, 9.0, 50), (2.3, 7.1, 31)])
+def test_equal_bin_index(low, high, num):
+
+    bins = np.linspace(low, high, num)
+    inv_width = (num - 1) / (high - low)
+
+    # Inside the bins, including values on and next to the edges
+    x = np.concatenate(
+        [
+            np.random.default_rng(42).uniform(low, high, 1000),
+            bins[:-1],
+            np.nextafter(bins[1:-1], -np.inf),
+            np.nextafter(bins[:-1], np.inf),
+        ]
+    )
+    assert np.array_equal(
+        equal_bin_index(x, bins, inv_width), np.digitize(x, bins) - 1
+    )
+
+    # Scalars are supported
+    assert equal_bin_index(bins[3], bins, inv_width) == 3
+
+    # Values outside are clamped to the first and last bin
+    assert np.array_equal(
+        equal_bin_index(np.array([low - 10, low - 1e-9]), bins, inv_width), [0, 0]
+    )
+    assert np.array_equal(
+        equal_bin_index(np.array([high, high + 1e-9, high + 10]), bins, inv_width),
+        [num - 2] * 3,
+    )
+
+
+def test_from_sim_index_grid():
+
+    rng = np.random.default_rng(42)
+    num = 100000
+    # Simulated with a flat spectrum in log(E)
+    energy = 10 ** rng.uniform(2, 9, num)
+    dec = np.arcsin(rng.uniform(-0.1, 1, num))
+
+    likelihood = MarginalisedEnergyLikelihoodFromSim(energy, dec, sim_index=1.0)
+    likelihood.set_src_dec(0.3)
+    grid = np.arange(1.5, 4.01, 0.25)
+    likelihood.precompute_grid(grid)
+
+    nbins = likelihood._energy_bins.size - 1
+    assert likelihood._likelihood.shape == (grid.size, nbins)
+
+    E = 10 ** np.linspace(2.1, 8.9, 20)
+    for low, high in zip(grid[:-1], grid[1:]):
+        below = likelihood(E, low, 0.3)
+        above = likelihood(E, high, 0.3)
+        # Histograms are evaluated at the grid points, interpolated in between
+        middle = likelihood(E, 0.5 * (low + high), 0.3)
+        assert np.allclose(middle, 0.5 * (below + above))
+        fifth = likelihood(E, low + 0.2 * (high - low), 0.3)
+        assert np.allclose(fifth, 0.8 * below + 0.2 * above)
+
+    # Each row is a normalised density in log10(E)
+    widths = np.diff(likelihood._energy_bins)
+    assert np.allclose(np.sum(likelihood._likelihood * widths, axis=1), 1.0)
+
+    # Grids not covering the accepted indices are refused, the previous grid is kept
+    with pytest.raises(ValueError):
+        likelihood.precompute_grid(np.arange(2.0, 4.01, 0.25))
+    with pytest.raises(ValueError):
+        likelihood.precompute_grid(np.arange(1.5, 3.51, 0.25))
+    assert np.array_equal(likelihood._index_grid, grid)
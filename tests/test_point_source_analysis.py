@@ -0,0 +1,343 @@
+from icecube_tools.point_source_analysis import point_source_analysis
+from icecube_tools.point_source_analysis.point_source_analysis import MapScan
+from icecube_tools.utils.data import ddict, SimEvents
+from icecube_tools.utils.coordinate_transforms import angular_separation
+
+import numpy as np
+import pytest
+import yaml
+from types import SimpleNamespace
+
+
+class FakeMapScan(MapScan):
+    """
+    MapScan without data files, the fit of each source is replaced
+    by a deterministic function of the source and the events.
+    """
+
+    def __init__(self, num: int = 150):
+
+        rng = np.random.default_rng(42)
+        self.events = SimpleNamespace(
+            periods=["IC86_II"],
+            ra={"IC86_II": rng.uniform(0, 2 * np.pi, 100)},
+            dec={"IC86_II": np.arcsin(rng.uniform(-1, 1, 100))},
+            ang_err={"IC86_II": rng.uniform(0.2, 2.0, 100)},
+            reco_energy={"IC86_II": 10 ** rng.uniform(2, 6, 100)},
+        )
+        self.ra_test = rng.uniform(0, 2 * np.pi, num)
+        self.dec_test = np.arcsin(rng.uniform(-1, 1, num))
+        self.output_path = None
+        self._make_output_arrays()
+
+    def write_output(self, path: str, source_list: bool = False):
+        pass
+
+    def _test_source(
+        self, source_coord, num, ra, dec, reco_energy, ang_err, minos=False
+    ):
+        src_ra, src_dec = source_coord
+        self.ts[num] = np.sum(np.cos(ra["IC86_II"] - src_ra)) + src_dec
+        self.index[num] = 2.0 + src_dec
+        self.fit_ok[num] = True
+        if minos:
+            self.index_merror[num] = [-src_ra, src_dec]
+
+
+@pytest.mark.parametrize("backend", ["process", "thread"])
+def test_parallel_scan_matches_sequential(backend):
+
+    sequential = FakeMapScan()
+    sequential.perform_scan(minos=True)
+
+    parallel = FakeMapScan()
+    parallel.perform_scan(minos=True, n_jobs=2, backend=backend)
+
+    assert np.all(parallel.fit_ok)
+    assert np.array_equal(parallel.ts, sequential.ts)
+    assert np.array_equal(parallel.index, sequential.index)
+    assert np.array_equal(parallel.index_merror, sequential.index_merror)
+
+
+@pytest.mark.parametrize(
+    "n_jobs, backend",
+    [
+        (0, "process"),
+        (-2, "process"),
+        (2.5, "process"),
+        ("2", "thread"),
+        (2, "mpi"),
+        (1, "mpi"),
+    ],
+)
+def test_parallel_scan_invalid_arguments(n_jobs, backend):
+
+    scan = FakeMapScan(num=5)
+
+    with pytest.raises(ValueError):
+        scan.perform_scan(n_jobs=n_jobs, backend=backend)
+
+
+@pytest.mark.parametrize(
+    "num, n_jobs, num_chunks",
+    [(0, 4, 1), (3, 8, 3), (100, 8, 8), (500, 16, 16), (500, 2, 9), (6000, 4, 100)],
+)
+def test_split_sources(num, n_jobs, num_chunks):
+
+    chunks = point_source_analysis._split_sources(num, n_jobs)
+
+    assert len(chunks) == num_chunks
+    assert np.array_equal(np.concatenate(chunks), np.arange(num))
+    assert all(chunk.size <= point_source_analysis._CHUNK_SIZE for chunk in chunks)
+
+
+def test_config_round_trip(tmp_path):
+
+    scan = FakeMapScan(num=3)
+    scan._data_periods = ["IC86_II"]
+    scan._which = "both"
+    # numpy scalars, e.g. results of numpy functions, are written as plain numbers
+    scan.nside = np.int64(1)
+    scan.npix = np.int64(12)
+    scan.northern_emin = np.float64(1e3)
+    scan.equator_emin = 1e1
+    scan.southern_emin = 1e5
+    scan.min_dec = np.rad2deg(np.float64(-0.1))
+    scan.max_dec = np.float32(80.0)
+
+    path = str(tmp_path / "config.yaml")
+    scan.write_config(path, source_list=True)
+
+    loaded = FakeMapScan.__new__(FakeMapScan)
+    loaded.load_config(path)
+
+    assert loaded.nside == 1
+    assert loaded.npix == 12
+    assert loaded._data_periods == ["IC86_II"]
+    assert loaded.which == "both"
+    assert loaded.northern_emin == 1e3
+    assert loaded.southern_emin == 1e5
+    assert loaded.min_dec == pytest.approx(np.rad2deg(-0.1))
+    assert loaded.max_dec == 80.0
+    assert np.allclose(loaded.ra_test, scan.ra_test)
+    assert np.allclose(loaded.dec_test, scan.dec_test)
+
+
+def test_load_legacy_ddict_config(tmp_path):
+
+    config = ddict()
+    config.add(1, "sources", "nside")
+    config.add(["IC86_II"], "data", "periods")
+    config.add(1e3, "data", "cuts", "northern", "emin")
+    config.add(1e1, "data", "cuts", "equator", "emin")
+    config.add(1e5, "data", "cuts", "southern", "emin")
+    config.add(-5.0, "data", "cuts", "min_dec")
+    config.add(90.0, "data", "cuts", "max_dec")
+    config.add("spatial", "data", "likelihood")
+
+    # Configs used to be written with the full yaml dumper, tagging the ddict class
+    path = str(tmp_path / "config.yaml")
+    with open(path, "w") as f:
+        yaml.dump(config, f, Dumper=yaml.Dumper)
+    with open(path, "r") as f:
+        assert "ddict" in f.read()
+
+    loaded = FakeMapScan.__new__(FakeMapScan)
+    loaded.load_config(path)
+
+    assert loaded.nside == 1
+    assert loaded._data_periods == ["IC86_II"]
+    assert loaded.northern_emin == 1e3
+    assert loaded.min_dec == -5.0
+    assert loaded.which == "spatial"
+
+
+@pytest.fixture
+def sim_events():
+
+    rng = np.random.default_rng(42)
+    events = SimEvents(seed=1234)
+    events._periods = ["IC86_I", "IC86_II"]
+    events._irf_periods = events._periods
+    events._data_periods = events._periods
+    for p in events.periods:
+        num = 1000
+        events._ra[p] = rng.uniform(0, 2 * np.pi, num)
+        events._dec[p] = np.arcsin(rng.uniform(-1, 1, num))
+        events._reco_energy[p] = 10 ** rng.uniform(1, 6, num)
+        events._ang_err[p] = rng.uniform(0.2, 2.0, num)
+        events._true_energy[p] = events._reco_energy[p]
+        events._arrival_energy[p] = events._reco_energy[p]
+        events._source_label[p] = np.zeros(num)
+    return events
+
+
+def test_apply_cuts(sim_events):
+
+    scan = FakeMapScan(num=1)
+    scan.events = sim_events
+    scan._irf_periods = sim_events.periods
+    scan.northern_emin = 1e2
+    scan.equator_emin = 1e3
+    scan.southern_emin = 1e5
+
+    # Selection as made before the masks were boolean arrays
+    horizon = np.deg2rad(10.0)
+    expected = {}
+    for p in sim_events.periods:
+        events = sim_events.period(p)
+        expected[p] = np.nonzero(
+            (
+                (events["reco_energy"] > scan.northern_emin)
+                & (events["dec"] >= horizon)
+            )
+            | (
+                (events["reco_energy"] > scan.equator_emin)
+                & (events["dec"] < horizon)
+                & (events["dec"] > -horizon)
+            )
+            | (
+                (events["reco_energy"] > scan.southern_emin)
+                & (events["dec"] <= -horizon)
+            )
+        )
+
+    scan.apply_cuts()
+
+    for p in sim_events.periods:
+        assert sim_events.mask[p].dtype == bool
+        assert np.array_equal(np.nonzero(sim_events.mask[p])[0], expected[p][0])
+        assert np.array_equal(sim_events.ra[p], sim_events._ra[p][expected[p]])
+
+
+def test_scramble_ra_with_boolean_mask(sim_events):
+
+    ra = {p: sim_events._ra[p].copy() for p in sim_events.periods}
+    mask = {p: sim_events._reco_energy[p] > 1e3 for p in sim_events.periods}
+    sim_events.mask = mask
+
+    sim_events.scramble_ra()
+
+    for p in sim_events.periods:
+        # Only events passing the mask are scrambled
+        assert np.array_equal(sim_events._ra[p][~mask[p]], ra[p][~mask[p]])
+        assert not np.any(sim_events._ra[p][mask[p]] == ra[p][mask[p]])
+        assert np.all((sim_events.ra[p] >= 0) & (sim_events.ra[p] < 2 * np.pi))
+        assert sim_events.ra[p].size == np.count_nonzero(mask[p])
+
+
+@pytest.fixture
+def healpix_scan(tmp_path, monkeypatch):
+
+    monkeypatch.setattr(point_source_analysis, "data_directory", str(tmp_path))
+    scan = FakeMapScan(num=1)
+    scan.ra_test = None
+    scan.dec_test = None
+    scan.nside = 16
+    scan.npix = None
+    scan.min_dec = -90.0
+    scan.max_dec = 90.0
+    return scan
+
+
+def test_healpix_coordinates_cache(healpix_scan, tmp_path, monkeypatch):
+
+    import healpy as hp
+
+    path = tmp_path / "healpix_radec_nside16.npy"
+    assert not path.exists()
+
+    ra, dec = healpix_scan._healpix_coordinates()
+
+    theta, phi = hp.pix2ang(16, np.arange(hp.nside2npix(16)))
+    assert path.exists()
+    assert np.array_equal(ra, phi)
+    assert np.array_equal(dec, np.pi / 2 - theta)
+    assert [_.name for _ in tmp_path.iterdir()] == [path.name]
+
+    # Second call loads the file without calculating the coordinates
+    def fail(*args, **kwargs):
+        raise AssertionError("coordinates calculated again")
+
+    monkeypatch.setattr(hp, "pix2ang", fail)
+    cached_ra, cached_dec = healpix_scan._healpix_coordinates()
+
+    assert isinstance(cached_ra, np.memmap)
+    assert np.array_equal(cached_ra, ra)
+    assert np.array_equal(cached_dec, dec)
+    assert [_.name for _ in tmp_path.iterdir()] == [path.name]
+
+
+@pytest.mark.parametrize("nside, radius", [(16, 3.0), (32, 5.0), (64, 3.0)])
+def test_generate_sources_near_events(healpix_scan, nside, radius):
+
+    healpix_scan.nside = nside
+    healpix_scan.generate_sources(radius=radius)
+
+    # Brute force distance of each pixel centre to its nearest event
+    ra_pix, dec_pix = healpix_scan._healpix_coordinates()
+    ra = healpix_scan.events.ra["IC86_II"]
+    dec = healpix_scan.events.dec["IC86_II"]
+    nearest = np.min(
+        angular_separation(
+            ra_pix[:, np.newaxis], dec_pix[:, np.newaxis], ra, dec
+        ),
+        axis=1,
+    )
+    expected = np.nonzero(nearest <= np.deg2rad(radius))[0]
+
+    assert 0 < expected.size < ra_pix.size
+    assert np.array_equal(healpix_scan.pix_test, expected)
+    assert np.array_equal(healpix_scan.ra_test, ra_pix[expected])
+    assert np.array_equal(healpix_scan.dec_test, dec_pix[expected])
+    assert healpix_scan.ts.shape == expected.shape
+
+
+def test_generate_sources_radius_needs_healpix(healpix_scan):
+
+    healpix_scan.ra_test = np.array([0.1, 0.2])
+    healpix_scan.dec_test = np.array([0.3, 0.4])
+
+    with pytest.raises(ValueError):
+        healpix_scan.generate_sources(radius=3.0)
+
+
+def test_healpix_map(healpix_scan):
+
+    healpix_scan.generate_sources(radius=3.0)
+    healpix_scan.ts[:] = np.arange(healpix_scan.ts.size) + 1.0
+    healpix_scan.index_merror[:] = 1.0
+
+    ts_map = healpix_scan.healpix_map(healpix_scan.ts, fill_value=-1.0)
+
+    assert ts_map.size == 12 * 16**2
+    assert np.array_equal(ts_map[healpix_scan.pix_test], healpix_scan.ts)
+    untested = np.ones(ts_map.size, dtype=bool)
+    untested[healpix_scan.pix_test] = False
+    assert np.all(ts_map[untested] == -1.0)
+
+    # Arrays with more than one entry per source
+    merror_map = healpix_scan.healpix_map(healpix_scan.index_merror)
+    assert merror_map.shape == (ts_map.size, 2)
+    assert np.all(merror_map[untested] == 0.0)
+
+    # Without pixels, there is no map to scatter into
+    healpix_scan.pix_test = None
+    with pytest.raises(ValueError):
+        healpix_scan.healpix_map(healpix_scan.ts)
+
+
+def test_pixels_in_output_round_trip(healpix_scan, tmp_path):
+
+    healpix_scan._data_periods = ["IC86_II"]
+    healpix_scan._which = "both"
+    healpix_scan.generate_sources(radius=3.0)
+    healpix_scan.ts[:] = np.arange(healpix_scan.ts.size)
+
+    path = str(tmp_path / "output.hdf5")
+    MapScan.write_output(healpix_scan, path, source_list=True)
+    output = MapScan.load_output(path)
+
+    assert np.array_equal(output["pix_test"], healpix_scan.pix_test)
+    assert np.array_equal(output["ra_test"], healpix_scan.ra_test)
+    assert np.array_equal(output["ts"], healpix_scan.ts)
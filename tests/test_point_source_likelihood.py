@@ -0,0 +1,401 @@
+from icecube_tools.point_source_likelihood.spatial_likelihood import (
+    EnergyDependentSpatialGaussianLikelihood,
+    EventDependentSpatialGaussianLikelihood,
+    SpatialGaussianLikelihood,
+)
+from icecube_tools.point_source_likelihood.point_source_likelihood import (
+    EnergyDependentSpatialPointSourceLikelihood,
+    PointSourceLikelihood,
+    SimpleWithEnergyPointSourceLikelihood,
+    SpatialOnlyPointSourceLikelihood,
+    log_likelihood_ratio_sum,
+)
+
+from icecube_tools.utils.coordinate_transforms import angular_separation
+
+import numpy as np
+import pytest
+
+
+class PowerLawEnergyLikelihood:
+    """
+    Stand-in for a marginalised energy likelihood, normalised power law above 100 GeV.
+    """
+
+    index_list = np.array([1.5, 2.0, 2.5, 3.0, 3.5, 4.0])
+
+    _min_index = 1.5
+
+    _max_index = 4.0
+
+    def __call__(self, energy, index, dec):
+        return (index - 1) / 1e2 * np.power(np.asarray(energy) / 1e2, -index)
+
+
+class LogLinearAngularResolution:
+    """
+    Stand-in for an angular resolution, improving with log(energy).
+    """
+
+    def __init__(self, scale):
+        self._scale = scale
+
+    def _get_angular_resolution(self, reco_energy):
+        return self._scale * 3.0 / np.log10(reco_energy)
+
+
+@pytest.fixture
+def events():
+    rng = np.random.default_rng(42)
+    num = 2000
+    ra = rng.uniform(0, 2 * np.pi, num)
+    dec = np.arcsin(rng.uniform(-1, 1, num))
+    energy = 1e2 * (1 - rng.uniform(size=num)) ** (-1 / 2.7)
+    ang_err = rng.uniform(0.2, 2.0, num)
+    # Some source events
+    ra[:20] = np.pi + rng.normal(0, 0.01, 20)
+    dec[:20] = 0.5 + rng.normal(0, 0.01, 20)
+    energy[:20] = 1e2 * (1 - rng.uniform(size=20)) ** (-1 / 1.2)
+    return ra, dec, energy, ang_err
+
+
+def make_likelihood(events, source_coord=(np.pi, 0.5)):
+    ra, dec, energy, ang_err = events
+    return PointSourceLikelihood(
+        SpatialGaussianLikelihood(1.0),
+        PowerLawEnergyLikelihood(),
+        ra,
+        dec,
+        energy,
+        ang_err,
+        source_coord,
+        cosz_bins=np.linspace(-1, 1, 41),
+    )
+
+
+def test_spatial_likelihood_vectorised():
+
+    spatial_likelihood = SpatialGaussianLikelihood(1.0)
+    source_coord = (np.pi, np.deg2rad(30))
+
+    ra = np.pi + np.linspace(-0.05, 0.05, num=11)
+    dec = np.full(ra.shape, np.deg2rad(30))
+
+    vectorised = spatial_likelihood(ra, dec, source_coord)
+    single = [spatial_likelihood(r, d, source_coord) for r, d in zip(ra, dec)]
+
+    assert vectorised == pytest.approx(single)
+
+    assert np.argmax(vectorised) == 5
+
+
+def test_event_dependent_spatial_likelihood_at_source():
+
+    spatial = EventDependentSpatialGaussianLikelihood()
+    source_coord = (np.pi, 0.5)
+    ang_err = np.array([0.5, 1.0, 2.0])
+
+    # Events exactly on the source and very close to it
+    ra = np.array([np.pi, np.pi, np.pi + 1e-9])
+    dec = np.array([0.5, 0.5, 0.5])
+
+    likelihood = spatial(ang_err, ra, dec, source_coord)
+    sigma = np.deg2rad(ang_err)
+
+    assert np.all(np.isfinite(likelihood))
+    # Peak of the Gaussian
+    assert likelihood[:2] == pytest.approx(0.5 / (np.pi * sigma[:2] ** 2))
+    assert likelihood[2] == pytest.approx(0.5 / (np.pi * sigma[2] ** 2))
+
+
+def test_log_likelihood_ratio_sum():
+
+    alpha_i = np.array([-0.5, 0.0, 2.0, 1e-12])
+    assert log_likelihood_ratio_sum(alpha_i) == pytest.approx(np.sum(np.log1p(alpha_i)))
+
+    # Below 1 + alpha = 1e-10 the logarithm is continued by its Taylor expansion
+    edge = 1e-10 - 1
+    below = np.array([edge - 1e-12, edge - 1e-11, -1.0, -2.0])
+    taylor = (below - edge) / 1e-10
+    expected = np.log(1e-10) + taylor - 0.5 * taylor**2
+    for alpha, value in zip(below, expected):
+        assert log_likelihood_ratio_sum(np.array([alpha])) == pytest.approx(value)
+    assert log_likelihood_ratio_sum(below) == pytest.approx(np.sum(expected))
+    assert np.all(np.isfinite(expected))
+
+    # Continuous at the edge
+    assert log_likelihood_ratio_sum(np.array([edge])) == pytest.approx(np.log(1e-10))
+    assert log_likelihood_ratio_sum(
+        np.array([edge * (1 + 1e-15)])
+    ) == pytest.approx(np.log(1e-10))
+
+
+@pytest.fixture
+def injected_events():
+    rng = np.random.default_rng(42)
+    num = 2000
+    ra = rng.uniform(0, 2 * np.pi, num)
+    dec = np.arcsin(rng.uniform(-1, 1, num))
+    energy = 10 ** rng.uniform(2, 6, num)
+    # 30 source events, spread by 1 deg around the source
+    sigma = np.deg2rad(1.0)
+    ra[:30] = np.pi + rng.normal(0, sigma, 30) / np.cos(0.5)
+    dec[:30] = 0.5 + rng.normal(0, sigma, 30)
+    return ra, dec, energy
+
+
+def test_spatial_only_fit(injected_events):
+
+    ra, dec, energy = injected_events
+
+    likelihood = SpatialOnlyPointSourceLikelihood(
+        SpatialGaussianLikelihood(1.0), list(zip(ra, dec)), (np.pi, 0.5)
+    )
+    ts = likelihood.get_test_statistic()
+
+    assert 20 < likelihood._best_fit_ns < 40
+    assert ts > 50
+
+    # No source events, no source
+    likelihood = SpatialOnlyPointSourceLikelihood(
+        SpatialGaussianLikelihood(1.0), list(zip(ra[30:], dec[30:])), (np.pi, 0.5)
+    )
+    ts = likelihood.get_test_statistic()
+
+    assert likelihood._best_fit_ns == pytest.approx(0, abs=1e-3)
+    assert ts == pytest.approx(0, abs=1e-3)
+
+
+def test_energy_dependent_spatial_fit(injected_events):
+
+    ra, dec, energy = injected_events
+    spatial = EnergyDependentSpatialGaussianLikelihood(
+        [LogLinearAngularResolution(s) for s in (0.8, 1.0, 1.5)], [2.0, 2.5, 3.7]
+    )
+
+    likelihood = EnergyDependentSpatialPointSourceLikelihood(
+        spatial, ra, dec, energy, (np.pi, 0.5)
+    )
+    ts = likelihood.get_test_statistic()
+
+    # Energies of the selected events are used
+    assert np.array_equal(likelihood._selected_energies, energy[likelihood._selected])
+    assert 15 < likelihood._best_fit_ns < 40
+    assert ts > 50
+
+
+def test_update_events_reuses_declination_order(events, monkeypatch):
+
+    likelihood = make_likelihood(events)
+
+    ra, dec, energy, ang_err = events
+    scrambled_ra = np.random.default_rng(1).permutation(ra)
+
+    # Same declinations, no new sorting is needed
+    def fail(*args, **kwargs):
+        raise AssertionError("events sorted again")
+
+    with monkeypatch.context() as m:
+        m.setattr(np, "argsort", fail)
+        likelihood.update_events(scrambled_ra, dec, energy, ang_err)
+
+    expected = make_likelihood((scrambled_ra, dec, energy, ang_err))
+
+    assert np.array_equal(likelihood._selected_ras, expected._selected_ras)
+    assert np.array_equal(likelihood._selected_decs, expected._selected_decs)
+    assert np.array_equal(likelihood._selected_energies, expected._selected_energies)
+
+    # New declinations are sorted again
+    shifted_dec = np.clip(dec + 0.01, -np.pi / 2, np.pi / 2)
+    likelihood.update_events(ra, shifted_dec, energy, ang_err)
+
+    assert np.all(np.diff(likelihood._decs) >= 0)
+
+
+def test_precomputed_cos_dec(events):
+
+    likelihood = make_likelihood(events)
+    src_ra, src_dec = likelihood.source_coord
+
+    assert np.allclose(
+        likelihood.angular_distance(),
+        angular_separation(
+            src_ra, src_dec, likelihood._selected_ras, likelihood._selected_decs
+        ),
+        rtol=1e-12,
+    )
+
+    # Event dependent spatial likelihood is the same with the cached cos(dec)
+    spatial = EventDependentSpatialGaussianLikelihood()
+    ra, dec, energy, ang_err = events
+    ang_err = ang_err[np.argsort(dec, kind="stable")][likelihood._selected]
+    assert np.allclose(
+        spatial(
+            ang_err,
+            likelihood._selected_ras,
+            likelihood._selected_decs,
+            likelihood.source_coord,
+            cos_dec=likelihood._selected_cos_decs,
+        ),
+        spatial(
+            ang_err,
+            likelihood._selected_ras,
+            likelihood._selected_decs,
+            likelihood.source_coord,
+        ),
+        rtol=1e-12,
+    )
+
+
+def test_declination_band_search_in_event_dtype(events, monkeypatch):
+
+    ra, dec, energy, ang_err = [np.array(_, dtype=np.float32) for _ in events]
+
+    # Put events onto the float32 values around the lower edge of the declination band
+    dec_low = make_likelihood(events)._dec_low
+    edge = np.float32(dec_low)
+    neighbours = [
+        np.nextafter(edge, np.float32(-1)),
+        edge,
+        np.nextafter(edge, np.float32(1)),
+    ]
+    dec[20:23] = neighbours
+    ra[20:23] = np.pi
+
+    searched = []
+    searchsorted = np.searchsorted
+
+    def checked_searchsorted(a, v, *args, **kwargs):
+        searched.append(np.asarray(v).dtype == a.dtype)
+        return searchsorted(a, v, *args, **kwargs)
+
+    monkeypatch.setattr(np, "searchsorted", checked_searchsorted)
+
+    single = make_likelihood((ra, dec, energy, ang_err))
+    double = make_likelihood(
+        tuple(np.array(_, dtype=np.float64) for _ in (ra, dec, energy, ang_err))
+    )
+
+    # Events are not cast to the dtype of the bounds
+    assert searched and all(searched)
+    # Same events as if compared in double precision
+    assert np.array_equal(single._selected_decs, double._selected_decs)
+    assert np.sum(single._selected_decs >= dec_low) == single.Nprime
+
+
+def test_fit_float32_events(events):
+
+    def fit(dtype):
+        ra, dec, energy, ang_err = [np.array(_, dtype=dtype) for _ in events]
+        likelihood = PointSourceLikelihood(
+            EventDependentSpatialGaussianLikelihood(),
+            PowerLawEnergyLikelihood(),
+            ra,
+            dec,
+            energy,
+            ang_err,
+            (np.pi, 0.5),
+            cosz_bins=np.linspace(-1, 1, 41),
+        )
+        ts = likelihood.get_test_statistic()
+        return likelihood, ts
+
+    single, ts_single = fit(np.float32)
+    double, ts_double = fit(np.float64)
+
+    # Likelihood values stay in double precision
+    assert single._signal_llh_spatial.dtype == np.float64
+
+    assert single.m.valid and double.m.valid
+    assert single.Nprime == double.Nprime
+    assert ts_single == pytest.approx(ts_double, rel=1e-3)
+    assert single._best_fit_ns == pytest.approx(double._best_fit_ns, rel=1e-3)
+    assert single._best_fit_index == pytest.approx(double._best_fit_index, abs=1e-2)
+
+
+@pytest.mark.parametrize("ns", [0.5, 5.0, 15.0])
+def test_derivatives_of_likelihood_ratio(events, ns):
+
+    likelihood = make_likelihood(events)
+    assert likelihood.Nprime > 0
+
+    def log_likelihood_ratio(ns):
+        return -likelihood._func_to_minimize(ns, 2.0)
+
+    step = 1e-4
+    first = (log_likelihood_ratio(ns + step) - log_likelihood_ratio(ns - step)) / (
+        2 * step
+    )
+    second = (
+        log_likelihood_ratio(ns + step)
+        - 2 * log_likelihood_ratio(ns)
+        + log_likelihood_ratio(ns - step)
+    ) / step**2
+
+    assert likelihood._first_derivative_likelihood_ratio(ns, 2.0) == pytest.approx(
+        first, rel=1e-5
+    )
+    assert likelihood._second_derivative_likelihood_ratio(ns) == pytest.approx(
+        second, rel=1e-3
+    )
+
+
+@pytest.mark.parametrize("index", [1.5, 2.2, 3.0, 4.0])
+def test_energy_dependent_spatial_likelihood_vectorised(events, index):
+
+    spatial = EnergyDependentSpatialGaussianLikelihood(
+        [LogLinearAngularResolution(s) for s in (0.8, 1.0, 1.5)], [2.0, 2.5, 3.7]
+    )
+
+    ra, dec, energy, ang_err = [_[:50] for _ in events]
+    source_coord = (np.pi, 0.5)
+
+    vectorised = spatial(ra, dec, source_coord, energy, index)
+
+    for r, d, e, v in zip(ra, dec, energy, vectorised):
+        sigma = np.interp(
+            index,
+            [2.0, 2.5, 3.7],
+            [s * 3.0 / np.log10(e) for s in (0.8, 1.0, 1.5)],
+        )
+        assert spatial._get_sigma(e, index) == pytest.approx(sigma)
+        assert spatial(r, d, source_coord, e, index) == pytest.approx(v)
+        assert v == pytest.approx(
+            SpatialGaussianLikelihood(sigma)(r, d, source_coord)
+        )
+
+
+def test_simple_with_energy_likelihood(events):
+
+    ra, dec, energy, ang_err = events
+    likelihood = SimpleWithEnergyPointSourceLikelihood(
+        SpatialGaussianLikelihood(1.0),
+        PowerLawEnergyLikelihood(),
+        list(zip(ra, dec)),
+        (np.pi, 0.5),
+        energy,
+    )
+
+    assert likelihood.N > 0
+    assert likelihood._selected_energies.size == likelihood.N
+
+    # Source events are in the sample, a harder spectrum is preferred
+    assert np.isfinite(likelihood(0.0, 2.0))
+    assert likelihood(10.0, 2.0) < likelihood(0.0, 2.0)
+    assert likelihood(10.0, 2.0) < likelihood(10.0, 3.5)
+
+    # Same as the direct evaluation of the mixture
+    f = 10.0 / likelihood.N
+    signal = likelihood._signal_likelihood(
+        likelihood._selected_ras,
+        likelihood._selected_decs,
+        (np.pi, 0.5),
+        likelihood._selected_energies,
+        2.0,
+    )
+    bg = likelihood._background_likelihood(
+        likelihood._selected_energies, likelihood._selected_decs
+    )
+    assert likelihood(10.0, 2.0) == pytest.approx(
+        -np.sum(np.log(f * signal + (1 - f) * bg))
+    )